@@ -0,0 +1,367 @@
+"""
+点字のレイアウト (セル列 -> 行 -> プレート)
+
+プレビューと書き出しで同じ分割結果を使うため、ここに集約する。
+LayoutEngine は直近の結果を (文書バージョン, 設定) をキーに保持し、
+内容か設定が変わったときだけ再レイアウトする。
+
+レイアウトには2つのモードがある。
+- LAYOUT_GREEDY: 入る限り詰めて改行する (従来の方式)
+- LAYOUT_OPTIMAL: 行数 (= プレート数) が最小で、できるだけ語の境界で改行し、
+  行末の余白が均等になる改行位置を動的計画法で求める
+"""
+from braille_logic import (
+    SPACE_MARK, DAKUTEN_MARK, HANDAKUTEN_MARK, YOON_MARK, YOON_DAKU_MARK,
+    YOON_HANDAKU_MARK, NUM_INDICATOR, FOREIGN_INDICATOR,
+)
+from perf_trace import tracer
+
+LAYOUT_GREEDY = 'greedy'
+LAYOUT_OPTIMAL = 'optimal'
+
+SPACE_DOTS = tuple(SPACE_MARK)
+
+# 後続のセルと同じ行に置く必要がある前置符
+PREFIX_MARKS = {
+    tuple(DAKUTEN_MARK), tuple(HANDAKUTEN_MARK), tuple(YOON_MARK),
+    tuple(YOON_DAKU_MARK), tuple(YOON_HANDAKU_MARK), tuple(NUM_INDICATOR), tuple(FOREIGN_INDICATOR)
+}
+
+
+def iter_flat_cells(entries):
+    """
+    単語エントリを行分割前のセル列に展開する。
+    セルの消えた単語は飛ばし、有効な単語同士の間にだけスペースを入れる。
+    """
+    has_previous = False
+    for word_idx, item in enumerate(entries):
+        if not item['cells']:
+            continue
+        if has_previous:
+            yield {'dots': SPACE_MARK, 'char': ' ', 'word_idx': -1, 'orig': '(Space)'}
+        for cell in item['cells']:
+            yield {
+                'dots': cell['dots'],
+                'char': cell['char'],
+                'word_idx': word_idx, # クリック時のために元のインデックスを保持
+                'orig': item['orig']
+            }
+        has_previous = True
+
+
+def count_flat_cells(entries):
+    """iter_flat_cells が出すセルの数 (セルの辞書は作らずに数える)"""
+    total = 0
+    words = 0
+    for item in entries:
+        if item['cells']:
+            total += len(item['cells'])
+            words += 1
+    return total + max(0, words - 1)
+
+
+def iter_units(cells):
+    """前置符と直後のセルを1単位にまとめる"""
+    pending = None
+    for cell in cells:
+        if pending is not None:
+            yield [pending, cell]
+            pending = None
+        elif tuple(cell['dots']) in PREFIX_MARKS:
+            pending = cell
+        else:
+            yield [cell]
+    if pending is not None:
+        yield [pending]
+
+
+def iter_lines(cells, max_chars):
+    """セル列を1行 max_chars 文字以内の行に分割する (前置符は行をまたがない)"""
+    current_line = []
+    for unit in iter_units(cells):
+        if len(current_line) + len(unit) > max_chars:
+            if len(current_line) > 0:
+                yield current_line
+                current_line = []
+        current_line.extend(unit)
+    if current_line:
+        yield current_line
+
+
+def iter_plates(lines, lines_per_plate):
+    """行を lines_per_plate 行ずつのプレートにまとめる"""
+    plate = []
+    for line in lines:
+        plate.append(line)
+        if len(plate) >= lines_per_plate:
+            yield plate
+            plate = []
+    if plate:
+        yield plate
+
+
+def iter_optimal_lines(cells, max_chars):
+    """
+    行数が最小になる改行位置を動的計画法で求めて行を返す。
+    行数が同じなら、語の途中での改行が少なく、行末の余白の二乗和が小さい分割を選ぶ。
+    改行位置の空白は行に含めない (行頭・行末の空白を落とす)。
+    前置符の単位は分けない。1行に入る単位数は max_chars 以下なので計算量はほぼ線形。
+    """
+    units = list(iter_units(cells))
+    n = len(units)
+    if n == 0:
+        return
+
+    is_space = [len(u) == 1 and tuple(u[0]['dots']) == SPACE_DOTS for u in units]
+    # widths[k]: units[:k] の幅の累積
+    widths = [0] * (n + 1)
+    for k, unit in enumerate(units):
+        widths[k + 1] = widths[k] + len(unit)
+    # lead[i]: units[i] から続く空白単位の数, trail[j]: units[j-1] で終わる空白単位の数
+    lead = [0] * (n + 1)
+    for k in range(n - 1, -1, -1):
+        lead[k] = lead[k + 1] + 1 if is_space[k] else 0
+    trail = [0] * (n + 1)
+    for k in range(1, n + 1):
+        trail[k] = trail[k - 1] + 1 if is_space[k - 1] else 0
+
+    # コストは (行数, 語の途中の改行数, 余白コスト) の辞書式順序を1つの整数で表す
+    break_weight = n * max_chars * max_chars + 1
+    line_weight = (n + 1) * break_weight
+
+    # best[j]: units[:j] を行に分けたときの最小コスト, back[j]: 最後の行の開始位置
+    best = [None] * (n + 1)
+    back = [0] * (n + 1)
+    best[0] = 0
+    for j in range(1, n + 1):
+        # units[j-1] と units[j] の間が語の境界か
+        word_break = 0 if (j == n or is_space[j - 1] or is_space[j]) else break_weight
+        base_cost = line_weight + word_break
+        width_j = widths[j - trail[j]]  # 行末の空白を除いた終端
+        min_cost, min_i = None, j - 1
+        i = j - 1
+        while i >= 0:
+            if lead[i] >= j - i:
+                width = 0   # 空白だけの行
+            else:
+                width = width_j - widths[i + lead[i]]
+            if width > max_chars and i < j - 1:
+                break
+            prev = best[i]
+            if prev is not None:
+                if j == n:
+                    cost = prev + base_cost
+                else:
+                    slack = max_chars - width
+                    cost = prev + base_cost + (slack * slack if slack > 0 else 0)
+                if min_cost is None or cost < min_cost:
+                    min_cost, min_i = cost, i
+            i -= 1
+        best[j], back[j] = min_cost, min_i
+
+    breaks = []
+    j = n
+    while j > 0:
+        breaks.append((back[j], j))
+        j = back[j]
+    breaks.reverse()
+
+    for i, j in breaks:
+        # 行頭・行末の空白を落とす
+        start, end = i, j
+        while start < end and is_space[start]:
+            start += 1
+        while end > start and is_space[end - 1]:
+            end -= 1
+        if start == end:
+            continue
+        line = []
+        for unit in units[start:end]:
+            line.extend(unit)
+        yield line
+
+
+def layout(cells, chars_per_line, lines_per_plate, mode=LAYOUT_GREEDY):
+    """セル列を行・プレートに分割し、プレートのリストを返す"""
+    if mode == LAYOUT_OPTIMAL:
+        lines = iter_optimal_lines(cells, int(chars_per_line))
+    else:
+        lines = iter_lines(cells, int(chars_per_line))
+    return list(iter_plates(lines, int(lines_per_plate)))
+
+
+class PagedLayout:
+    """
+    プレートを必要になった時点でレイアウトする (通常の改行モード)。
+    各プレートの開始セル位置をチェックポイントとして記録し、プレートNへは
+    直前のチェックポイントから行の区切りだけを求めて移動する。
+    セル列も必要な分だけ前段のイテレータから取り出す。
+    plates を渡した場合は、レイアウト済みのプレートをそのまま返す。
+    cells_hint はセル列の長さ (分かっていれば)。estimated_count の見込みに使う。
+    """
+    PLATE_CACHE_SIZE = 32
+
+    def __init__(self, cells=(), chars_per_line=10, lines_per_plate=4, plates=None, cells_hint=0):
+        self.chars_per_line = int(chars_per_line)
+        self.lines_per_plate = int(lines_per_plate)
+        self.cells_hint = cells_hint
+        self._plates = plates
+        self._cells_iter = iter(cells)
+        self._cells = []
+        self._plate_starts = [0]
+        self._complete = False
+        self._plate_cache = {}
+
+    def _has(self, i):
+        """i番目のセルがあるか (必要ならイテレータから読み進める)"""
+        while len(self._cells) <= i:
+            cell = next(self._cells_iter, None)
+            if cell is None:
+                return False
+            self._cells.append(cell)
+        return True
+
+    def _line_end(self, start):
+        """start から始まる行の終端 (次の行の開始位置)"""
+        width = 0
+        i = start
+        while self._has(i):
+            unit = 1
+            if tuple(self._cells[i]['dots']) in PREFIX_MARKS and self._has(i + 1):
+                unit = 2
+            if width + unit > self.chars_per_line and width > 0:
+                break
+            width += unit
+            i += unit
+        return i
+
+    def _seek(self, n):
+        """プレートnの開始位置。プレートが存在しなければ None"""
+        while len(self._plate_starts) <= n:
+            if self._complete:
+                return None
+            pos = self._plate_starts[-1]
+            for _ in range(self.lines_per_plate):
+                end = self._line_end(pos)
+                if end == pos:
+                    break
+                pos = end
+            if self._has(pos):
+                self._plate_starts.append(pos)
+            else:
+                self._complete = True
+        return self._plate_starts[n]
+
+    def plate(self, n):
+        """n番目 (0始まり) のプレートの行リスト。範囲外なら IndexError"""
+        if self._plates is not None:
+            return self._plates[n]
+        if n < 0:
+            raise IndexError(n)
+        if n in self._plate_cache:
+            return self._plate_cache[n]
+        with tracer.span("layout"):
+            return self._layout_plate(n)
+
+    def _layout_plate(self, n):
+        pos = self._seek(n)
+        if pos is None or not self._has(pos):
+            raise IndexError(n)
+        lines = []
+        for _ in range(self.lines_per_plate):
+            end = self._line_end(pos)
+            if end == pos:
+                break
+            lines.append(self._cells[pos:end])
+            pos = end
+        if len(self._plate_cache) >= self.PLATE_CACHE_SIZE:
+            self._plate_cache.pop(next(iter(self._plate_cache)))
+        self._plate_cache[n] = lines
+        return lines
+
+    def has_plate(self, n):
+        if self._plates is not None:
+            return 0 <= n < len(self._plates)
+        pos = self._seek(n)
+        return pos is not None and self._has(pos)
+
+    def count(self):
+        """総プレート数 (行の区切りを最後まで求める)"""
+        if self._plates is not None:
+            return len(self._plates)
+        while self._seek(len(self._plate_starts)) is not None:
+            pass
+        return len(self._plate_starts) if self._has(0) else 0
+
+    def estimated_count(self):
+        """
+        総プレート数の見込み (行の区切りを最後までは求めない)。
+        区切りを求め終えていれば正確な値、途中ならそこまでの枚数と
+        1枚あたりのセル数から見込んだ枚数の大きい方を返す。
+        """
+        if self._plates is not None:
+            return len(self._plates)
+        if not self._has(0):
+            return 0
+        known = len(self._plate_starts)
+        if self._complete or known < 2 or not self.cells_hint:
+            return known
+        cells_per_plate = self._plate_starts[-1] / (known - 1)
+        return max(known, int(-(-self.cells_hint // cells_per_plate)))
+
+    def __iter__(self):
+        n = 0
+        while self.has_plate(n):
+            yield self.plate(n)
+            n += 1
+
+    def all(self):
+        if self._plates is not None:
+            return self._plates
+        return list(self)
+
+
+class LayoutEngine:
+    """直近のレイアウト結果をキャッシュし、プレビューと書き出しで共有する"""
+    def __init__(self):
+        self._key = None
+        self._pages = None
+        # 最適改行モードで、通常の改行より減ったプレート数
+        self.plates_saved = 0
+
+    def _make_key(self, version, chars_per_line, lines_per_plate, mode):
+        return (version, int(chars_per_line), int(lines_per_plate), mode)
+
+    def paged_document(self, mapped_data, version, chars_per_line, lines_per_plate, mode=LAYOUT_GREEDY):
+        """
+        mapped data のレイアウトを PagedLayout として返す。
+        version は文書の内容が変わるたびに増やすカウンタ。同じキーなら前回の結果を返す。
+        通常の改行モードではプレートは参照された時点でレイアウトされる。
+        """
+        key = self._make_key(version, chars_per_line, lines_per_plate, mode)
+        if key != self._key:
+            self.plates_saved = 0
+            if mode == LAYOUT_OPTIMAL:
+                # 最適改行は文書全体で決まるため一括でレイアウトする
+                with tracer.span("layout"):
+                    cells = list(iter_flat_cells(mapped_data))
+                    plates = layout(cells, chars_per_line, lines_per_plate, mode)
+                    greedy = PagedLayout(cells, chars_per_line, lines_per_plate)
+                    self.plates_saved = greedy.count() - len(plates)
+                self._pages = PagedLayout(plates=plates)
+            else:
+                self._pages = PagedLayout(
+                    iter_flat_cells(mapped_data), chars_per_line, lines_per_plate,
+                    cells_hint=count_flat_cells(mapped_data),
+                )
+            self._key = key
+        return self._pages
+
+    def layout_document(self, mapped_data, version, chars_per_line, lines_per_plate, mode=LAYOUT_GREEDY):
+        """paged_document の全プレートをリストで返す"""
+        return self.paged_document(mapped_data, version, chars_per_line, lines_per_plate, mode).all()
+
+    def invalidate(self):
+        self._key = None
+        self._pages = None
+        self.plates_saved = 0
@@ -1,4 +1,13 @@
+import importlib.util
+import multiprocessing
+import os
 import re
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+from perf_trace import tracer
 
 # 特殊符定義
 DAKUTEN_MARK      = [0,0,0,0,1,0] # 5の点
@@ -52,85 +61,486 @@ SPECIAL_KANA_RULES = {
     'ぴゃ': ('YOON_HANDAKU', 'は'), 'ぴゅ': ('YOON_HANDAKU', 'ふ'), 'ぴょ': ('YOON_HANDAKU', 'ほ'),
 }
 
-# 安全なインポート処理
-try:
-    from janome.tokenizer import Tokenizer
-    JANOME_AVAILABLE = True
-except ImportError:
-    JANOME_AVAILABLE = False
-    Tokenizer = None
+# 文字種 (スクリプト) 分類
+SCRIPT_KANJI = 'kanji'
+SCRIPT_HIRAGANA = 'hiragana'
+SCRIPT_KATAKANA = 'katakana'
+SCRIPT_DIGIT = 'digit'
+SCRIPT_LATIN = 'latin'
+SCRIPT_SPACE = 'space'
+SCRIPT_SYMBOL = 'symbol'
+SCRIPT_JAPANESE = 'japanese'  # 形態素解析に回す区間 (漢字を含む)
+SCRIPT_KANA = 'kana'  # かなだけの区間 (規則で分かち書きする)
+
+# 形態素解析が必要な文字 (漢字・繰り返し記号など)
+KANJI_RANGES = (
+    (0x3400, 0x4DBF),   # CJK統合漢字拡張A
+    (0x4E00, 0x9FFF),   # CJK統合漢字
+    (0xF900, 0xFAFF),   # CJK互換漢字
+    (0x20000, 0x2FFFF), # CJK統合漢字拡張B以降
+)
+KANJI_EXTRA_CHARS = set('々〆ヶヵ〇')
+
+# スパンの区切りとなる文字種
+DELIMITER_SCRIPTS = {SCRIPT_SPACE, SCRIPT_SYMBOL}
+
+# 形態素解析が必要な文字種 (かなだけの区間は _split_kana で分ける)
+TOKENIZE_SCRIPTS = {SCRIPT_KANJI}
+KANA_SCRIPTS = {SCRIPT_HIRAGANA, SCRIPT_KATAKANA}
+
+# かなだけの区間の分かち書きに使う助詞・助動詞 (長いものから照合する)
+# 語の中にも現れる1文字の助詞 (は・が・に など) は、カタカナ語の直後でだけ切り出す
+KANA_PARTICLES = sorted((
+    'から', 'まで', 'より', 'では', 'には', 'とは', 'でも', 'にも', 'への',
+    'は', 'が', 'を', 'に', 'へ', 'で', 'と', 'も', 'の', 'や',
+), key=len, reverse=True)
+KANA_AUXILIARIES = sorted((
+    'です', 'でした', 'でしょう', 'ます', 'ました', 'ません', 'ましょう',
+), key=len, reverse=True)
+KANA_FINAL_PARTICLES = sorted(('ね', 'よ', 'か', 'よね'), key=len, reverse=True)
+
+# 読みの上書き (ユーザー辞書) で、システム辞書にない語を登録するときの品詞とコスト
+# (simpledic と同じ値。1語にまとまるように強いコストにする)
+OVERRIDE_POS = 'カスタム名詞,*,*,*'
+OVERRIDE_COST = -100000
+
+# Janome は辞書を読み込むとき (_load_tokenizer) に初めて import する
+# (janome の import でシステム辞書の初期化まで走るため、このモジュールの import 時には読み込まない)
+JANOME_AVAILABLE = importlib.util.find_spec("janome") is not None
+
+# 一括変換ワーカーの変換器 (ワーカープロセスごとに _init_worker で作る)
+_worker_converter = None
+
+def _init_worker(reading_overrides):
+    global _worker_converter
+    _worker_converter = BrailleConverter()
+    if reading_overrides:
+        _worker_converter.update_reading_overrides(reading_overrides, background=False)
+
+def _convert_in_worker(text):
+    return _worker_converter.convert_with_mapping(text)
+
+def _prewarm_dictionary():
+    """
+    ワーカーを起動する前に、辞書の各部分をバイナリファイルかスナップショットから読めるようにしておく。
+    読めない部分がある (スナップショットが無効・書き込めない) 場合は False を返す。
+    """
+    from janome import sysdic
+    return sysdic.prewarm()
+
+def _worker_context():
+    """
+    ワーカープールの start method。
+    Flet のサーバープロセスはスレッドを抱えているため fork はせず、
+    forkserver (使えなければ spawn) で新しいプロセスから起動する。
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
 
 class BrailleConverter:
-    def __init__(self):
+    def __init__(self, defer_load=False, service=None):
+        """
+        defer_load=True の場合は辞書 (Tokenizer) を読み込まずに返す。
+        load_async() で別スレッドで読み込み、それまでの変換は _fallback_convert で行う。
+        service (tokenizer_service.TokenizerService) を渡すと、自前の Tokenizer は作らず
+        プロセスで共有する Tokenizer を解析のたびに借りる。変換器が持つのは読みの上書きだけになる。
+        """
         self.use_kakasi = False # UI互換用変数
         self.tokenizer = None
+        self.service = service
+        self._user_dic = None  # 読みの上書きをコンパイルしたユーザー辞書
         self.error_msg = ""
+        self.load_seconds = 0.0  # 辞書の読み込みにかかった時間
+        self._ready = threading.Event()
+        # 表記 -> 読み(ひらがな) の上書き
+        self.reading_overrides = {}
+        self._overrides_generation = 0
+        self._overrides_lock = threading.Lock()
         
-        if JANOME_AVAILABLE:
-            try:
-                self.tokenizer = Tokenizer()
-                self.use_kakasi = True
-            except Exception as e:
-                self.error_msg = str(e)
-                print(f"Janome Init Error: {e}")
-        else:
+        if not JANOME_AVAILABLE:
             self.error_msg = "Module 'janome' not found"
+            self._ready.set()
+        elif not defer_load:
+            self._load_tokenizer()
+
+    @property
+    def is_ready(self):
+        """辞書の読み込みが終わっているか (失敗した場合も True)"""
+        return self._ready.is_set()
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def load_async(self, on_ready=None):
+        """辞書の読み込みを別スレッドで始める。終わったら on_ready() を呼ぶ"""
+        if self.is_ready:
+            # 読み込み済み (または Janome が使えない) ならすぐに呼ぶ
+            if on_ready:
+                on_ready()
+            return
+
+        def run():
+            self._load_tokenizer()
+            if on_ready:
+                on_ready()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _load_tokenizer(self):
+        started = time.perf_counter()
+        try:
+            if self.service is not None:
+                # 辞書はプロセスで1回だけ読み込む (読み込み済みならすぐ返る)
+                self.service.load()
+                tokenizer = None
+            else:
+                from janome.tokenizer import Tokenizer
+                tokenizer = Tokenizer()
+        except Exception as e:
+            self.error_msg = str(e)
+            print(f"Janome Init Error: {e}")
+        else:
+            self.tokenizer = tokenizer
+            self.use_kakasi = True
+            # 読み込み中に登録された読みの上書きをユーザー辞書に反映する
+            with self._overrides_lock:
+                overrides = dict(self.reading_overrides)
+                generation = self._overrides_generation
+            if overrides:
+                self._compile_reading_overrides(overrides, generation)
+        finally:
+            self.load_seconds = time.perf_counter() - started
+            self._ready.set()
 
     def convert_with_mapping(self, text):
-        result_data = []
-        current_index = 0
         if not text: return []
+        return list(self.iter_convert_with_mapping(text))
+
+    def iter_convert_with_mapping(self, text):
+        """convert_with_mapping のジェネレータ版。スパン単位で単語エントリを逐次返す"""
+        if not text: return
+
+        # Janomeと同様に前後の空白は除外する (オフセットは元テキスト基準)
+        body = text.strip()
+        offset = len(text) - len(text.lstrip())
+
+        # 処理段の時間はスパン・単語ごとではなく、変換1回分を合計して記録する
+        timer = tracer.stage_timer()
+        try:
+            for script, start, span in self._split_script_spans(body):
+                if script == SCRIPT_JAPANESE:
+                    # 漢字を含むスパンは形態素解析に回す (分かち書きのため)
+                    yield from self._tokenize_span(span, offset + start, timer)
+                elif script == SCRIPT_KANA:
+                    # かなだけのスパンは規則で分かち書きする (Janomeを経由しない)
+                    for word_start, word in self._split_kana(span):
+                        reading = self.reading_overrides.get(word)
+                        if reading is None:
+                            reading = self._katakana_to_hiragana(word)
+                        yield self._make_entry(word, reading, offset + start + word_start, timer)
+                else:
+                    # 数字・英字・記号はそのまま点字化 (Janomeを経由しない)
+                    reading = self.reading_overrides.get(span)
+                    if reading is None:
+                        reading = self._katakana_to_hiragana(span)
+                    yield self._make_entry(span, reading, offset + start, timer)
+        finally:
+            timer.flush()
 
-        if self.use_kakasi and self.tokenizer:
-            try:
-                # Janomeで形態素解析
-                tokens = self.tokenizer.tokenize(text)
-                for token in tokens:
-                    orig_word = token.surface
-                    # 読み(カタカナ)を取得
-                    reading_kata = token.reading if token.reading != '*' else token.surface
-                    # カタカナ -> ひらがな変換
-                    reading = self._katakana_to_hiragana(reading_kata)
-                    
-                    word_len = len(orig_word)
-                    start = current_index
-                    end = current_index + word_len
-                    current_index += word_len
-
-                    cells = self.kana_to_cells(reading)
-                    
-                    dots_only = [c['dots'] for c in cells]
-
-                    result_data.append({
-                        'orig': orig_word,
-                        'reading': reading,
-                        'braille': dots_only,
-                        'cells': cells,
-                        'start': start,
-                        'end': end
-                    })
-            except Exception as e:
-                print(f"Tokenize Error: {e}")
-                result_data = self._fallback_convert(text)
+    def update_reading_overrides(self, overrides, background=True):
+        """
+        表記 -> 読み の上書きを反映する。
+        上書きはJanomeのユーザー辞書にコンパイルされ、形態素解析の時点で適用される。
+        background=True の場合、コンパイルは別スレッドで行う。
+        """
+        with self._overrides_lock:
+            self.reading_overrides = dict(overrides)
+            self._overrides_generation += 1
+            generation = self._overrides_generation
+
+        if not self.use_kakasi:
+            return
+        if background:
+            threading.Thread(
+                target=self._compile_reading_overrides,
+                args=(dict(overrides), generation),
+                daemon=True,
+            ).start()
         else:
-            result_data = self._fallback_convert(text)
+            self._compile_reading_overrides(dict(overrides), generation)
+
+    def _compile_reading_overrides(self, overrides, generation):
+        """上書きをipadic形式のユーザー辞書にコンパイルしてTokenizerに差し込む"""
+        user_dic = None
+        try:
+            rows = self._override_rows(overrides)
+            if rows:
+                from janome.dic import UserDictionary
+                fd, csv_path = tempfile.mkstemp(suffix='.csv')
+                try:
+                    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                        f.write("\n".join(rows) + "\n")
+                    sys_dic = self.service.sys_dic if self.service is not None else self.tokenizer.sys_dic
+                    user_dic = UserDictionary(csv_path, 'utf8', 'ipadic', sys_dic.connections)
+                finally:
+                    os.remove(csv_path)
+        except Exception as e:
+            print(f"User Dictionary Compile Error: {e}")
+            return
+
+        with self._overrides_lock:
+            # 新しい上書きが後から来ていれば破棄する
+            if generation == self._overrides_generation:
+                self._user_dic = user_dic
+                if self.tokenizer is not None:
+                    self.tokenizer.user_dic = user_dic
 
+    def _override_rows(self, overrides):
+        """
+        読みの上書きを ipadic 形式の行にする。
+        システム辞書にある表記は、その見出し (連接ID・コスト・品詞) をそのまま写して読みだけを差し替える。
+        同じコストなら先に引かれるユーザー辞書の方が選ばれるので、語の区切りは上書き前と変わらない。
+        辞書にない2文字以上の表記は、1語にまとまるように強いコストで登録する。
+        辞書にない1文字の表記は登録しない (強いコストの1文字語は前後の語の区切りを奪うため)。
+        """
+        rows = []
+        with self._checkout_tokenizer() as tokenizer:
+            sys_dic, matcher = tokenizer.sys_dic, tokenizer.matcher
+            for surface, reading in overrides.items():
+                # CSVとして表現できない表記はスキップ
+                if not surface or any(c in surface + reading for c in ',\r\n') or surface != surface.strip():
+                    continue
+                entries = [e for e in sys_dic.lookup(surface.encode('utf-8'), matcher) if e[1] == surface]
+                for num, _, left_id, right_id, cost in entries:
+                    part_of_speech, infl_type, infl_form, base_form = sys_dic.lookup_extra(num)[:4]
+                    rows.append(",".join([
+                        surface, str(left_id), str(right_id), str(cost),
+                        part_of_speech, infl_type, infl_form, base_form, reading, reading,
+                    ]))
+                if not entries and len(surface) >= 2:
+                    rows.append(",".join([
+                        surface, "0", "0", str(OVERRIDE_COST),
+                        OVERRIDE_POS, "*", "*", surface, reading, reading,
+                    ]))
+        return rows
+
+    def convert_many(self, texts, workers=None, chunksize=None):
+        """複数テキストを一括変換し、入力順に mapped data のリストを返す"""
+        return list(self.iter_convert_many(texts, workers=workers, chunksize=chunksize))
+
+    def iter_convert_many(self, texts, workers=None, chunksize=None):
+        """
+        複数テキストを入力順に変換して逐次返すジェネレータ。
+        ワーカーは forkserver (なければ spawn) で起動する新しいプロセスで、それぞれ Janome を
+        import して自分の変換器を作る (読みの上書きは initargs で渡す)。
+        起動前にこのプロセスで辞書のスナップショットを用意しておくので、ワーカーは辞書を
+        モジュールから作り直さず、バイナリファイルかスナップショットを mmap して読む
+        (データは OS のページキャッシュ越しに共有される)。
+        どちらも使えない場合や、ワーカー数1の場合はこのプロセスで順に変換する。
+        変換器の状態はプール (呼び出し) ごとに閉じているので、複数のセッションから同時に呼んでもよい。
+        """
+        # 一括変換は辞書の読み込みを待ってから行う
+        self.wait_ready()
+        texts = list(texts)
+        if workers is None:
+            workers = os.cpu_count() or 1
+        workers = min(workers, len(texts))
+        if workers > 1 and not (self.use_kakasi and _prewarm_dictionary()):
+            # ワーカーごとに辞書を作り直すことになるため、プールは使わない
+            workers = 1
+
+        if workers <= 1:
+            for text in texts:
+                yield self.convert_with_mapping(text)
+            return
+
+        if chunksize is None:
+            chunksize = max(1, len(texts) // (workers * 4))
+
+        with self._overrides_lock:
+            overrides = dict(self.reading_overrides)
+        with _worker_context().Pool(workers, initializer=_init_worker, initargs=(overrides,)) as pool:
+            for mapped_data in pool.imap(_convert_in_worker, texts, chunksize):
+                yield mapped_data
+
+    def _tokenize_span(self, text, start_index, timer):
+        """漢字・かなを含むスパンをJanomeで解析する (所要時間は timer に合計する)"""
+        if not self.use_kakasi:
+            return self._fallback_convert(text, start_index, timer)
+
+        result_data = []
+        current_index = start_index
+        try:
+            # Janomeで形態素解析
+            with timer.span("tokenize"):
+                with self._checkout_tokenizer() as tokenizer:
+                    tokens = list(tokenizer.tokenize(text))
+            for token in tokens:
+                orig_word = token.surface
+                # 読み(カタカナ)を取得
+                reading_kata = token.reading if token.reading != '*' else token.surface
+                # カタカナ -> ひらがな変換
+                reading = self._katakana_to_hiragana(reading_kata)
+
+                result_data.append(self._make_entry(orig_word, reading, current_index, timer))
+                current_index += len(orig_word)
+        except Exception as e:
+            print(f"Tokenize Error: {e}")
+            result_data = self._fallback_convert(text, start_index, timer)
         return result_data
 
-    def _fallback_convert(self, text):
+    def _checkout_tokenizer(self):
+        """解析に使う Tokenizer (共有サービスの場合はこのセッションのユーザー辞書を付けて借りる)"""
+        if self.service is not None:
+            return self.service.checkout(self._user_dic)
+        return nullcontext(self.tokenizer)
+
+    def _split_script_spans(self, text):
+        """
+        テキストを1パスで文字種ごとのランに分け、(種別, 開始位置, 文字列) のスパンを逐次返す。
+        空白・記号で区切られた区間に漢字が含まれる場合、その区間全体を SCRIPT_JAPANESE として返す。
+        漢字を含まない区間では、続いたひらがな・カタカナのランを1つの SCRIPT_KANA スパンにまとめる。
+        """
+        segment = []        # 区切り文字間のラン [(種別, 開始, 終了), ...]
+        segment_is_japanese = False
+
+        def flush_segment():
+            spans = []
+            if segment_is_japanese:
+                seg_start, seg_end = segment[0][1], segment[-1][2]
+                spans.append((SCRIPT_JAPANESE, seg_start, text[seg_start:seg_end]))
+            else:
+                for script, run_start, run_end in segment:
+                    if script in KANA_SCRIPTS:
+                        script = SCRIPT_KANA
+                        if spans and spans[-1][0] == SCRIPT_KANA:
+                            run_start = spans.pop()[1]
+                    spans.append((script, run_start, text[run_start:run_end]))
+            segment.clear()
+            return spans
+
+        run_script = None
+        run_start = 0
+        for i, char in enumerate(text):
+            script = self._char_script(char)
+            # 長音符は直前の文字種に続ける
+            if char == 'ー' and run_script in (SCRIPT_HIRAGANA, SCRIPT_KATAKANA):
+                script = run_script
+            if script == run_script:
+                continue
+
+            if run_script is not None:
+                if run_script in DELIMITER_SCRIPTS:
+                    yield (run_script, run_start, text[run_start:i])
+                else:
+                    segment.append((run_script, run_start, i))
+            if script in DELIMITER_SCRIPTS:
+                yield from flush_segment()
+                segment_is_japanese = False
+            elif script in TOKENIZE_SCRIPTS:
+                segment_is_japanese = True
+            run_script, run_start = script, i
+
+        if run_script is not None:
+            if run_script in DELIMITER_SCRIPTS:
+                yield (run_script, run_start, text[run_start:])
+            else:
+                segment.append((run_script, run_start, len(text)))
+        yield from flush_segment()
+
+    def _split_kana(self, text):
+        """
+        かなだけの文字列を規則で単語に分け、(開始位置, 単語) を逐次返す。
+        カタカナとひらがなの境目、「を」の前後、カタカナ語の直後の助詞、
+        ひらがなのランの末尾の助動詞 (です・ます など) と終助詞で区切る。
+        """
+        runs = []  # [(カタカナか, 開始, 終了), ...]
+        for i, char in enumerate(text):
+            is_katakana = self._char_script(char) == SCRIPT_KATAKANA
+            # 長音符は直前の文字種に続ける
+            if runs and (char == 'ー' or runs[-1][0] == is_katakana):
+                runs[-1] = (runs[-1][0], runs[-1][1], i + 1)
+            else:
+                runs.append((is_katakana, i, i + 1))
+
+        after_katakana = False
+        for is_katakana, run_start, run_end in runs:
+            if is_katakana:
+                yield run_start, text[run_start:run_end]
+                after_katakana = True
+                continue
+            # 「を」は語の中に現れないので、常に1語として切り出す
+            pos = run_start
+            for piece in text[run_start:run_end].split('を'):
+                yield from self._split_hiragana(piece, pos, after_katakana)
+                pos += len(piece)
+                if pos < run_end:
+                    yield pos, 'を'
+                    pos += 1
+                after_katakana = False
+
+    def _split_hiragana(self, text, start, after_katakana):
+        """ひらがなのランを 助詞 / 語 / 助動詞 / 終助詞 に分ける"""
+        head = ''
+        if after_katakana:
+            head = next((p for p in KANA_AUXILIARIES + KANA_PARTICLES if text.startswith(p)), '')
+        body = text[len(head):]
+
+        tail = []
+        final = next((p for p in KANA_FINAL_PARTICLES if body.endswith(p)), '')
+        aux = next((p for p in KANA_AUXILIARIES if body[:len(body) - len(final)].endswith(p)), '')
+        if aux:
+            # 終助詞は助動詞の後ろにあるときだけ切り出す
+            tail = [aux, final] if final else [aux]
+            body = body[:len(body) - len(aux) - len(final)]
+
+        pos = start
+        for word in (head, body, *tail):
+            if word:
+                yield pos, word
+                pos += len(word)
+
+    def _char_script(self, char):
+        """1文字の文字種を判定する"""
+        if char.isspace():
+            return SCRIPT_SPACE
+        code = ord(char)
+        if char in KANJI_EXTRA_CHARS:
+            return SCRIPT_KANJI
+        for low, high in KANJI_RANGES:
+            if low <= code <= high:
+                return SCRIPT_KANJI
+        if 0x3041 <= code <= 0x309F:
+            return SCRIPT_HIRAGANA
+        if 0x30A1 <= code <= 0x30FA or code == 0x30FC:
+            return SCRIPT_KATAKANA
+        if char.isdigit():
+            return SCRIPT_DIGIT
+        if char.isascii() and char.isalpha():
+            return SCRIPT_LATIN
+        return SCRIPT_SYMBOL
+
+    def _make_entry(self, orig_word, reading, start, timer=None):
+        if timer is None:
+            cells = self.kana_to_cells(reading)
+        else:
+            with timer.span("cells"):
+                cells = self.kana_to_cells(reading)
+        return {
+            'orig': orig_word,
+            'reading': reading,
+            'braille': [c['dots'] for c in cells],
+            'cells': cells,
+            'start': start,
+            'end': start + len(orig_word)
+        }
+
+    def _fallback_convert(self, text, start_index=0, timer=None):
         """フォールバック（そのままひらがなとして処理）"""
         result_data = []
-        current_index = 0
+        current_index = start_index
         for char in text:
-            cells = self.kana_to_cells(char)
-            result_data.append({
-                'orig': char,
-                'reading': char,
-                'braille': [c['dots'] for c in cells],
-                'cells': cells,
-                'start': current_index,
-                'end': current_index + 1
-            })
+            result_data.append(self._make_entry(char, char, current_index, timer))
             current_index += 1
         return result_data
 
@@ -218,4 +628,4 @@ class BrailleConverter:
             mark_char = "拗゜"
         
         cells.append({'dots': mark, 'char': mark_char})
-        cells.append({'dots': BRAILLE_MAP.get(base_char, SPACE_MARK), 'char': base_char})
\ No newline at end of file
+        cells.append({'dots': BRAILLE_MAP.get(base_char, SPACE_MARK), 'char': base_char})
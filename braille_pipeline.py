@@ -0,0 +1,35 @@
+"""
+点字変換のストリーミングパイプライン
+
+テキスト → 単語エントリ → セル → 行 → プレート の各段をジェネレータで繋ぎ、
+前段から必要な分だけ取り出して処理する。長文でも最初のプレートから順に
+プレビュー・書き出しができ、パイプライン自体のメモリ使用量は入力長に依存しない。
+セル以降の段は braille_layout のものを使う。
+"""
+from braille_layout import iter_flat_cells, iter_lines, iter_plates
+
+
+def iter_word_entries(converter, text, sink=None):
+    """
+    テキストを単語エントリ (mapped data の要素) に逐次変換する。
+    sink にリストを渡すと、生成したエントリをそこにも追加する (編集用に保持する場合)。
+    """
+    for item in converter.iter_convert_with_mapping(text):
+        if sink is not None:
+            sink.append(item)
+        yield item
+
+
+def iter_entry_plates(entries, chars_per_line, lines_per_plate):
+    """
+    単語エントリのイテレータからプレートを逐次返す。
+    途中で取り出すのをやめた場合、entries の残りはそのまま読み進められる。
+    """
+    lines = iter_lines(iter_flat_cells(entries), int(chars_per_line))
+    return iter_plates(lines, int(lines_per_plate))
+
+
+def stream_plates(converter, text, chars_per_line, lines_per_plate, sink=None):
+    """テキストからプレートまでを一続きのジェネレータとして返す"""
+    entries = iter_word_entries(converter, text, sink)
+    return iter_entry_plates(entries, chars_per_line, lines_per_plate)
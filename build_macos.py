@@ -40,6 +40,10 @@ def main():
         print("Upgrading flet to the latest version...")
         run_command("pip install --upgrade flet")
 
+        # 辞書の FST を mmap で読めるバイナリにしておく (起動時の base64 デコードを省く)
+        print("Generating dictionary binaries...")
+        run_command(f"{sys.executable} -m janome.sysdic", ignore_error=True)
+
         # 1. クリーンアップ
         if os.path.exists("build"):
             print("Cleaning build directory...")
@@ -144,6 +144,10 @@ def main():
         print("Installing dependencies...")
         run_command("pip install -r requirements.txt")
 
+    # 辞書の FST を mmap で読めるバイナリにしておく (起動時の base64 デコードを省く)
+    print("Generating dictionary binaries...")
+    run_command(f"{sys.executable} -m janome.sysdic", ignore_error=True)
+
     targets = ["ios", "android"] if args.target == "all" else [args.target]
 
     for t in targets:
@@ -0,0 +1,80 @@
+"""
+読みの修正の取り消し・やり直し
+
+文書全体を複製せず、修正1回分を差分 (単語インデックスごとの修正前の読み・セル) として積む。
+セルのリストは mapped data から外れたものへの参照を持つだけなので、
+数百回分を積んでも文書のコピーは作らない。
+"""
+from collections import deque, namedtuple
+
+from word_index import apply_reading
+
+# 修正1回分の差分
+# before: 各インデックスの修正前の (読み, セル, 点字, 手動修正の記録)
+# prev_override: 修正前の表記 -> 読みの上書き (なければ None)
+ReadingEdit = namedtuple('ReadingEdit', 'indices surface reading cells before prev_override')
+
+
+class EditHistory:
+    def __init__(self, limit=500):
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+
+    def clear(self):
+        """文書が入れ替わったときに呼ぶ (インデックスが変わるため)"""
+        self._undo.clear()
+        self._redo.clear()
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def apply(self, mapped_data, edits, indices, surface, reading, cells, prev_override=None):
+        """
+        読みの修正を mapped data に当て、取り消せるように記録する。
+        edits は単語インデックス -> (表記, 読み) の手動修正の記録 (一緒に更新する)。
+        """
+        before = tuple(
+            (mapped_data[idx]['reading'], mapped_data[idx]['cells'], mapped_data[idx]['braille'], edits.get(idx))
+            for idx in indices
+        )
+        edit = ReadingEdit(tuple(indices), surface, reading, cells, before, prev_override)
+        self._redo.clear()
+        self._undo.append(edit)
+        self._apply_forward(mapped_data, edits, edit)
+        return edit
+
+    def undo(self, mapped_data, edits):
+        """直前の修正を取り消し、その差分を返す (取り消すものがなければ None)"""
+        if not self._undo:
+            return None
+        edit = self._undo.pop()
+        for idx, (reading, cells, braille, prev_edit) in zip(edit.indices, edit.before):
+            item = mapped_data[idx]
+            item['reading'] = reading
+            item['cells'] = cells
+            item['braille'] = braille
+            if prev_edit is None:
+                edits.pop(idx, None)
+            else:
+                edits[idx] = prev_edit
+        self._redo.append(edit)
+        return edit
+
+    def redo(self, mapped_data, edits):
+        """取り消した修正をやり直し、その差分を返す (やり直すものがなければ None)"""
+        if not self._redo:
+            return None
+        edit = self._redo.pop()
+        self._apply_forward(mapped_data, edits, edit)
+        self._undo.append(edit)
+        return edit
+
+    def _apply_forward(self, mapped_data, edits, edit):
+        apply_reading(mapped_data, edit.indices, edit.reading, edit.cells)
+        for idx in edit.indices:
+            edits[idx] = (edit.surface, edit.reading)
@@ -1,21 +1,72 @@
 import flet as ft
+import atexit
+import base64
+import copy
 import json
 import os
+import tempfile
+import threading
+import weakref
+import zlib
 from datetime import datetime
 
+from history_store import SQLiteHistoryStore, content_hash, text_hash
+
+# 終了時に未書き出しの変更を書き出すマネージャー
+# (弱参照で持つので、閉じたセッションのマネージャーを終了まで生かし続けることはない)
+_live_managers = weakref.WeakSet()
+
+
+def _flush_all_at_exit():
+    for manager in list(_live_managers):
+        manager.flush(at_exit=True)
+
+
+atexit.register(_flush_all_at_exit)
+
 class HistoryManager:
-    def __init__(self, page: ft.Page):
+    """
+    設定・履歴・読みの上書きの保存
+    メモリ上の値を正とし、変更されたキーは少し待ってから別スレッドでまとめて書き出す
+    (スライダー操作のような連続した変更でも、その場ではストレージにアクセスしない)。
+    """
+    FLUSH_DELAY = 1.0  # 最後の変更からこの秒数だけ変更がなければ書き出す
+    COMPRESSED_PREFIX = "zlib:"
+
+    def __init__(self, page: ft.Page, compress_history=False, history_db_path=None):
+        """
+        compress_history=True の場合、履歴は zlib で圧縮した文字列として保存する。
+        history_db_path を渡すと、履歴は SQLite に保存する (件数の上限なし・全文検索あり)。
+        """
         self.page = page
+        self.compress_history = compress_history
         self.history_key = "tenji_pfab_history_v2" # データ構造が変わるためキーを変更
         self.config_key = "tenji_pfab_config_v1"
+        self.overrides_key = "tenji_pfab_reading_overrides_v1"
+        self.texts_key = "tenji_pfab_history_texts_v1" # 本文のハッシュ -> 本文 (履歴から参照する)
         
-        self._mem_config = {}
-        self._mem_history = []
+        self._cache = {}  # キー -> 値 (ストレージから読んだ後はこちらが正)
+        self._dirty = set()  # 書き出しが済んでいないキー
+        self._file_data = None  # ファイルモードでのファイル全体の内容
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()  # 書き出しを1つずつ行う (古い内容で上書きしない)
+        self._flush_timer = None
         
         self._storage_mode = 'client' 
         self._local_file_path = os.path.join(os.path.expanduser("~"), ".tenji_pfab_data.json")
+        # 終了時に未書き出しの変更を書き出す
+        _live_managers.add(self)
 
-    # --- 内部メソッド (変更なし) ---
+        self._store = None
+        if history_db_path:
+            try:
+                self._store = SQLiteHistoryStore(history_db_path)
+            except Exception as e:
+                print(f"History DB Open Error: {e}, using key-value storage.")
+            else:
+                self._migrate_history_to_store()
+
+    # --- 内部メソッド ---
     def _load_from_file(self):
         try:
             if os.path.exists(self._local_file_path):
@@ -26,16 +77,45 @@ class HistoryManager:
         return {}
 
     def _save_to_file(self, data):
+        """一時ファイルに書いてから置き換える (書き込み途中で落ちても元のファイルは壊れない)"""
         try:
-            with open(self._local_file_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False)
+            dir_name = os.path.dirname(self._local_file_path) or "."
+            fd, tmp_path = tempfile.mkstemp(prefix=".tenji_pfab_", suffix=".tmp", dir=dir_name)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+                os.replace(tmp_path, self._local_file_path)
+            except:
+                os.remove(tmp_path)
+                raise
             return True
         except:
             return False
 
+    def _file_contents(self):
+        if self._file_data is None:
+            self._file_data = self._load_from_file()
+        return self._file_data
+
+    def _encode(self, key, value):
+        """保存用の形式に変換する (履歴は必要に応じて圧縮)"""
+        if key == self.history_key and self.compress_history and value:
+            raw = json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            return self.COMPRESSED_PREFIX + base64.b64encode(zlib.compress(raw, 9)).decode('ascii')
+        return value
+
+    def _decode(self, key, value):
+        # 圧縮の有無は保存された値で判断する (設定を切り替えても読める)
+        if isinstance(value, str) and value.startswith(self.COMPRESSED_PREFIX):
+            raw = zlib.decompress(base64.b64decode(value[len(self.COMPRESSED_PREFIX):]))
+            return json.loads(raw.decode('utf-8'))
+        return value
+
     def _switch_to_fallback(self):
-        test_data = {"config": self._mem_config, "history": self._mem_history}
-        if self._save_to_file(test_data):
+        data = self._file_contents()
+        for key, value in self._cache.items():
+            data[key] = self._encode(key, value)
+        if self._save_to_file(data):
             self._storage_mode = 'file'
             print("Switched to Local File storage.")
         else:
@@ -43,69 +123,165 @@ class HistoryManager:
             print("Switched to Memory-only storage.")
 
     def _safe_get(self, key, default_value):
-        if self._storage_mode == 'memory':
-            if key == self.config_key: return self._mem_config or default_value
-            if key == self.history_key: return self._mem_history or default_value
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key] or default_value
 
-        if self._storage_mode == 'file':
-            data = self._load_from_file()
-            return data.get(key, default_value)
+            if self._storage_mode == 'memory':
+                return default_value
 
-        try:
-            if self.page.client_storage.contains_key(key):
-                val = self.page.client_storage.get(key)
-                if key == self.config_key: self._mem_config = val
-                if key == self.history_key: self._mem_history = val
-                return val
-            return default_value
-        except Exception as e:
-            print(f"Client Storage READ Error ({key}): {e}, switching mode.")
-            self._switch_to_fallback()
-            return self._safe_get(key, default_value)
+            if self._storage_mode == 'file':
+                val = self._decode(key, self._file_contents().get(key))
+                self._cache[key] = val
+                return val or default_value
+
+            try:
+                val = None
+                if self.page.client_storage.contains_key(key):
+                    val = self._decode(key, self.page.client_storage.get(key))
+                self._cache[key] = val
+                return val or default_value
+            except Exception as e:
+                print(f"Client Storage READ Error ({key}): {e}, switching mode.")
+                self._switch_to_fallback()
+                return self._safe_get(key, default_value)
 
     def _safe_set(self, key, value):
-        if key == self.config_key: self._mem_config = value
-        if key == self.history_key: self._mem_history = value
+        """メモリ上の値を更新し、書き出しを予約する"""
+        with self._lock:
+            self._cache[key] = value
+            if self._storage_mode == 'memory':
+                return
+            self._dirty.add(key)
+            # 変更が続いている間は書き出しを先送りする
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
 
-        if self._storage_mode == 'memory':
-            return
+    def flush(self, at_exit=False):
+        """
+        未書き出しの変更をストレージに書き出す
+        書き出す内容はロック中に複製して取り出し、ストレージへの書き込みはロックを外してから行う
+        (書き出し中も _safe_get / _safe_set は待たされず、書き出す値が途中で書き換わることもない)。
+        at_exit=True (終了時) はクライアントストレージに書けなくてもファイルには切り替えない
+        (Web 版ではセッションが閉じていて書けないのが普通で、サーバー側にファイルを作ってしまうため)。
+        """
+        with self._write_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty or self._storage_mode == 'memory':
+                    self._dirty.clear()
+                    return
+                keys = list(self._dirty)
+                self._dirty.clear()
+                mode = self._storage_mode
+                values = {key: copy.deepcopy(self._encode(key, self._cache[key])) for key in keys}
+                if mode == 'file':
+                    data = self._file_contents()
+                    data.update(values)
+                    data = copy.deepcopy(data)
 
-        if self._storage_mode == 'file':
-            current_data = self._load_from_file()
-            current_data[key] = value
-            if not self._save_to_file(current_data):
-                print("File Save Error, switching to memory mode.")
-                self._storage_mode = 'memory'
-            return
+            if mode == 'file':
+                if not self._save_to_file(data):
+                    print("File Save Error, switching to memory mode.")
+                    with self._lock:
+                        self._storage_mode = 'memory'
+                return
+
+            try:
+                for key, value in values.items():
+                    self.page.client_storage.set(key, value)
+            except Exception as e:
+                if at_exit:
+                    print(f"Client Storage WRITE Error at exit: {e}")
+                    return
+                print(f"Client Storage WRITE Error: {e}, switching mode.")
+                with self._lock:
+                    self._switch_to_fallback()
 
+    def _migrate_history_to_store(self):
+        """キー・バリュー側に残っている履歴を、DBが空のときに一度だけ移す"""
         try:
-            self.page.client_storage.set(key, value)
+            if not self._store.is_empty():
+                return
+            old = self._kv_history()
+            if not old:
+                return
+            for item in reversed(old):
+                self._store.add(item)
+            self._safe_set(self.history_key, [])
+            self._safe_set(self.texts_key, {})
         except Exception as e:
-            print(f"Client Storage WRITE Error ({key}): {e}, switching mode.")
-            self._switch_to_fallback()
-            self._safe_set(key, value)
+            print(f"History Migration Error: {e}")
 
     # --- 公開メソッド（履歴） ---
 
-    def get_history(self):
+    def _kv_history_raw(self):
         data = self._safe_get(self.history_key, [])
         if not isinstance(data, list): return []
         return data
 
-    def add_entry(self, text, current_settings, mapped_data=None):
+    def _kv_history_texts(self):
+        data = self._safe_get(self.texts_key, {})
+        if not isinstance(data, dict): return {}
+        return data
+
+    def _kv_history(self):
+        """キー・バリュー側の履歴 (本文をハッシュから引いて埋めたもの)"""
+        texts = self._kv_history_texts()
+        return [
+            dict(item, text=texts.get(item["text_hash"], "")) if "text_hash" in item else item
+            for item in self._kv_history_raw()
+        ]
+
+    def _compact_entry(self, item, texts):
+        """本文を直接持つ旧形式の履歴を、ハッシュで本文を参照する形にする"""
+        if "text_hash" in item:
+            return item
+        text = item.get("text", "")
+        t_hash = text_hash(text)
+        texts.setdefault(t_hash, text)
+        compact = {k: v for k, v in item.items() if k != "text"}
+        compact["hash"] = content_hash(item)
+        compact["text_hash"] = t_hash
+        return compact
+
+    def get_history(self):
+        if self._store is not None:
+            return self._store.search(limit=self.get_history_limit())[0]
+        return self._kv_history()
+
+    def search_history(self, query="", cursor=None, limit=20):
         """
-        履歴を追加する
-        mapped_data: 編集済みの点字データ構造 (手動修正を復元するために必要)
+        履歴を新しい順に最大 limit 件返す。query があれば本文にその語を含むものだけ。
+        戻り値は (履歴のリスト, 次のページの cursor)。続きがなければ cursor は None。
         """
+        if self._store is not None:
+            return self._store.search(query, cursor, limit)
         history = self.get_history()
-        limit = self.get_history_limit()
-        
+        if query:
+            history = [item for item in history if query in item.get("text", "")]
+        start = cursor or 0
+        end = start + limit
+        return history[start:end], (end if end < len(history) else None)
+
+    def add_entry(self, text, current_settings, edits=None):
+        """
+        履歴を追加する
+        edits: 読みの手動修正 [[単語インデックス, 表記, 読み], ...]
+               (点字データ全体は保存せず、復元時にテキストから変換し直して修正を当てる)
+        """
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
         
         # 設定値の抽出
         chars = int(current_settings.get("max_chars_per_line", 10))
         lines = int(current_settings.get("max_lines_per_plate", 3))
         thick = float(current_settings.get("plate_thickness", 1.0))
+        edits = [list(edit) for edit in (edits or [])]
 
         entry = {
             "text": text,
@@ -113,32 +289,45 @@ class HistoryManager:
             "max_chars_per_line": chars,
             "max_lines_per_plate": lines,
             "plate_thickness": thick,
-            "mapped_data": mapped_data  # 編集データも保存
+            "edits": edits  # 読みの修正箇所だけを保存
         }
         
-        # 重複チェック（テキストと設定が完全に同じならタイムスタンプ更新のみ）
-        # ただしmapped_dataがある場合は編集内容が違う可能性があるので、簡易チェックに留める
-        if history:
-            last = history[0]
-            if (last.get("text") == text and 
-                last.get("max_chars_per_line") == chars and
-                last.get("max_lines_per_plate") == lines and
-                last.get("plate_thickness") == thick):
-                
-                # 内容が同じなら更新して終了
-                last["timestamp"] = timestamp
-                last["mapped_data"] = mapped_data
-                self._safe_set(self.history_key, history)
-                return
+        if self._store is not None:
+            # SQLite には追記する (件数の上限なし、同じ内容なら先頭に移す)
+            self._store.add(entry)
+            return
+
+        limit = self.get_history_limit()
+        texts = dict(self._kv_history_texts())
+        c_hash = content_hash(entry)
+        t_hash = text_hash(text)
+
+        # 同じ内容 (本文・設定・修正) の履歴は、履歴全体から探して先頭に移す
+        history = []
+        for item in self._kv_history_raw():
+            item = self._compact_entry(item, texts)
+            if item["hash"] != c_hash:
+                history.append(item)
 
-        history.insert(0, entry)
+        stored = {k: v for k, v in entry.items() if k != "text"}
+        stored["hash"] = c_hash
+        stored["text_hash"] = t_hash
+        texts[t_hash] = text
+        history.insert(0, stored)
         if len(history) > limit:
             history = history[:limit]
-            
+
+        # 本文はハッシュごとに1つだけ持ち、どの履歴からも参照されなくなったものは捨てる
+        used = {item["text_hash"] for item in history}
+        self._safe_set(self.texts_key, {h: t for h, t in texts.items() if h in used})
         self._safe_set(self.history_key, history)
 
     def clear_history(self):
+        if self._store is not None:
+            self._store.clear()
+            return
         self._safe_set(self.history_key, [])
+        self._safe_set(self.texts_key, {})
 
     def get_history_limit(self):
         config = self.load_settings()
@@ -155,6 +344,28 @@ class HistoryManager:
         return data
 
     def save_settings(self, new_settings):
-        config = self.load_settings()
-        config.update(new_settings)
-        self._safe_set(self.config_key, config)
\ No newline at end of file
+        # キャッシュの dict は書き換えず、新しい dict に差し替える (書き出し中の値と共有しない)
+        with self._lock:
+            config = dict(self.load_settings())
+            config.update(new_settings)
+            self._safe_set(self.config_key, config)
+
+    # --- 公開メソッド（読みの上書き） ---
+
+    def get_reading_overrides(self):
+        """表記 -> 読み の上書き辞書を返す"""
+        data = self._safe_get(self.overrides_key, {})
+        if not isinstance(data, dict): return {}
+        return data
+
+    def set_reading_override(self, surface, reading):
+        overrides = dict(self.get_reading_overrides())
+        overrides[surface] = reading
+        self._safe_set(self.overrides_key, overrides)
+        return overrides
+
+    def remove_reading_override(self, surface):
+        overrides = dict(self.get_reading_overrides())
+        overrides.pop(surface, None)
+        self._safe_set(self.overrides_key, overrides)
+        return overrides
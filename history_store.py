@@ -0,0 +1,183 @@
+"""
+SQLite による履歴の保存 (デスクトップ版で使う)
+
+履歴は1件1行で追記し、一覧は保存日時の新しい順にインデックスを使って
+ページ単位で取り出す。本文は FTS5 (trigram) で全文検索できるようにする。
+件数に上限を設けなくても、一覧を開くコストは1ページ分で済む。
+
+履歴は (本文, 設定, 読みの修正) のハッシュをキーにする。同じ内容を保存し直すと
+新しい行は作らず、既存の履歴を先頭に移す。本文はハッシュで1回だけ保存し、履歴から参照する。
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    content_hash TEXT NOT NULL UNIQUE,
+    text_hash TEXT NOT NULL REFERENCES texts (hash),
+    created REAL NOT NULL,
+    timestamp TEXT NOT NULL,
+    max_chars_per_line INTEGER NOT NULL,
+    max_lines_per_plate INTEGER NOT NULL,
+    plate_thickness REAL NOT NULL,
+    edits TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_created ON entries (created DESC, id DESC);
+CREATE INDEX IF NOT EXISTS entries_text ON entries (text_hash);
+"""
+
+# 本文の全文検索用 (trigram は日本語でも部分一致で引ける)
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS texts_fts USING fts5(
+    text, content='texts', content_rowid='rowid', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS texts_fts_insert AFTER INSERT ON texts BEGIN
+    INSERT INTO texts_fts (rowid, text) VALUES (new.rowid, new.text);
+END;
+CREATE TRIGGER IF NOT EXISTS texts_fts_delete AFTER DELETE ON texts BEGIN
+    INSERT INTO texts_fts (texts_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+END;
+"""
+
+FTS_MIN_QUERY = 3  # trigram で検索できる最短の文字数 (これより短い語は LIKE で探す)
+
+_COLUMNS = (
+    "e.id, e.created, e.timestamp, t.text, e.max_chars_per_line, e.max_lines_per_plate,"
+    " e.plate_thickness, e.edits"
+)
+_FROM = "entries e JOIN texts t ON t.hash = e.text_hash"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def content_hash(entry):
+    """履歴の内容 (本文, 設定, 読みの修正) のハッシュ。保存日時は含めない"""
+    key = [
+        entry.get("text", ""),
+        int(entry.get("max_chars_per_line", 10)),
+        int(entry.get("max_lines_per_plate", 3)),
+        float(entry.get("plate_thickness", 1.0)),
+        [list(edit) for edit in entry.get("edits") or []],
+    ]
+    return hashlib.sha256(
+        json.dumps(key, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+
+
+class SQLiteHistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Flet のイベントは複数のスレッドから呼ばれるため、接続はロックで守って共有する
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError as e:
+            # FTS5 / trigram が使えない SQLite では LIKE で検索する
+            print(f"History FTS unavailable: {e}")
+            self.has_fts = False
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _row_to_entry(self, row):
+        return {
+            "id": row[0],
+            "created": row[1],
+            "timestamp": row[2],
+            "text": row[3],
+            "max_chars_per_line": row[4],
+            "max_lines_per_plate": row[5],
+            "plate_thickness": row[6],
+            "edits": json.loads(row[7]),
+        }
+
+    def is_empty(self):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM entries LIMIT 1").fetchone() is None
+
+    def add(self, entry):
+        """
+        履歴を保存し、その id を返す。
+        同じ内容の履歴が既にあれば、新しい行は作らずその履歴を先頭 (最新) に移す。
+        """
+        text = entry.get("text", "")
+        t_hash = text_hash(text)
+        c_hash = content_hash(entry)
+        edits = [list(edit) for edit in entry.get("edits") or []]
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR IGNORE INTO texts (hash, text) VALUES (?, ?)", (t_hash, text))
+            self._conn.execute(
+                "INSERT INTO entries (content_hash, text_hash, created, timestamp, max_chars_per_line,"
+                " max_lines_per_plate, plate_thickness, edits) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (content_hash) DO UPDATE SET created = excluded.created, timestamp = excluded.timestamp",
+                (
+                    c_hash,
+                    t_hash,
+                    time.time(),
+                    entry.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M"),
+                    int(entry.get("max_chars_per_line", 10)),
+                    int(entry.get("max_lines_per_plate", 3)),
+                    float(entry.get("plate_thickness", 1.0)),
+                    json.dumps(edits, ensure_ascii=False),
+                ),
+            )
+            return self._conn.execute(
+                "SELECT id FROM entries WHERE content_hash = ?", (c_hash,)
+            ).fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM texts")
+
+    def search(self, query="", cursor=None, limit=20):
+        """
+        新しい順に最大 limit 件を返す。query があれば本文にその語を含むものだけ。
+        戻り値は (履歴のリスト, 次のページの cursor)。続きがなければ cursor は None。
+        """
+        where = []
+        params = []
+        query = (query or "").strip()
+        if query and self.has_fts and len(query) >= FTS_MIN_QUERY:
+            where.append(
+                "t.rowid IN (SELECT rowid FROM texts_fts WHERE texts_fts MATCH ?)"
+            )
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            where.append("t.text LIKE ? ESCAPE '\\'")
+            escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            params.append(f"%{escaped}%")
+        if cursor is not None:
+            # (保存日時, id) で前のページの続きから読む (OFFSET を使わないので深いページも速い)
+            where.append("(e.created, e.id) < (?, ?)")
+            params.extend(cursor)
+        sql = f"SELECT {_COLUMNS} FROM {_FROM}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY e.created DESC, e.id DESC LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        entries = [self._row_to_entry(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = entries[-1]
+            next_cursor = (last["created"], last["id"])
+        return entries, next_cursor
@@ -17,7 +17,11 @@ import os
 import io
 import pickle
 import gzip
-from struct import pack, unpack
+import hashlib
+import tempfile
+import mmap
+from array import array
+from struct import pack, unpack, unpack_from, Struct
 import traceback
 import logging
 import sys
@@ -44,14 +48,96 @@ MODULE_CONNECTIONS = 'connections%d.py'
 MODULE_CHARDEFS = 'chardef.py'
 MODULE_UNKNOWNS = 'unknowns.py'
 
+FILE_FST_DATA = 'fst_data%d.bin'
+FILE_ENTRIES_DATA = 'entries.bin'
+FILE_CONNECTIONS_DATA = 'connections.bin'
 FILE_USER_FST_DATA = 'user_fst.data'
 FILE_USER_ENTRIES_DATA = 'user_entries.data'
 
+# Every binary file of the system dictionary starts with magic, format version and source key.
+# The source key is a 20-byte digest of the modules the file was generated from
+# (see janome.sysdic.source_key); a file whose key differs from the installed modules is stale.
+BINARY_PREFIX = Struct('<4sI20s')
+
+# Binary FST data (FILE_FST_DATA):
+#   header : magic, format version, source key
+#   data   : the compiled FST, as in the fst_data modules but not base64-encoded
+FST_DATA_MAGIC = b'JSDF'
+FST_DATA_FORMAT_VERSION = 1
+FST_DATA_HEADER = BINARY_PREFIX
+
+# Binary system dictionary entries (FILE_ENTRIES_DATA):
+#   header  : magic, format version, source key, number of entries
+#   records : one fixed-width record per morph id, in id order.
+#             compact part: surface (heap offset, byte length), left_id, right_id, cost
+#             extra part: part_of_speech, infl_type, infl_form, base_form, reading, phonetic
+#             (each as heap offset, byte length)
+#   heap    : UTF-8 strings, each distinct string stored once
+ENTRIES_MAGIC = b'JSDE'
+ENTRIES_FORMAT_VERSION = 2
+ENTRIES_HEADER = Struct('<4sI20sI')
+ENTRIES_COMPACT_RECORD = Struct('<IHHHh')
+ENTRIES_EXTRA_RECORD = Struct('<' + 'IH' * 6)
+ENTRIES_RECORD_SIZE = ENTRIES_COMPACT_RECORD.size + ENTRIES_EXTRA_RECORD.size
+
+# Binary connection cost matrix (FILE_CONNECTIONS_DATA):
+#   header : magic, format version, source key, number of rows, number of columns
+#   costs  : little-endian int16, row-major
+CONNECTIONS_MAGIC = b'JSDC'
+CONNECTIONS_FORMAT_VERSION = 2
+CONNECTIONS_HEADER = Struct('<4sI20sII')
+
+# Warm-start snapshot of the immutable dictionary state:
+#   header  : magic, format version, state key, number of buffers, pickle length,
+#             file length, SHA-1 digest of everything after the header
+#   table   : (offset, length) of each out-of-band buffer
+#   pickle  : the state pickled with protocol 5; large arrays are out-of-band buffers
+#   buffers : raw buffer contents, 8-byte aligned
+SNAPSHOT_MAGIC = b'JSNP'
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_HEADER = Struct('<4sI20sIQQ20s')
+
 
 def save_fstdata(data, dir, part=0):
     _save_as_module(os.path.join(dir, MODULE_FST_DATA % part), data, binary=True)
 
 
+def save_fstdata_binary(data, key, dir, part=0):
+    # raw (not base64) bytes so that the data can be memory-mapped as is
+    header = FST_DATA_HEADER.pack(FST_DATA_MAGIC, FST_DATA_FORMAT_VERSION, key)
+    _save_binary(os.path.join(dir, FILE_FST_DATA % part), header, data)
+
+
+def save_entries_binary(entries, key, dir='.'):
+    """
+    Save system dictionary entries (morph id -> 10-field tuple, ids from 0 without gaps)
+    in the binary fixed-record format. key is the source key stored in the header.
+    """
+    count = len(entries)
+    heap = bytearray()
+    interned = {}
+
+    def intern(s):
+        ref = interned.get(s)
+        if ref is None:
+            data = s.encode('utf8')
+            ref = interned[s] = (len(heap), len(data))
+            heap.extend(data)
+        return ref
+
+    records = bytearray(count * ENTRIES_RECORD_SIZE)
+    for morph_id in range(count):
+        entry = entries[morph_id]
+        pos = morph_id * ENTRIES_RECORD_SIZE
+        ENTRIES_COMPACT_RECORD.pack_into(records, pos, *intern(entry[0]), entry[1], entry[2], entry[3])
+        extra = []
+        for field in entry[4:10]:
+            extra.extend(intern(field))
+        ENTRIES_EXTRA_RECORD.pack_into(records, pos + ENTRIES_COMPACT_RECORD.size, *extra)
+    header = ENTRIES_HEADER.pack(ENTRIES_MAGIC, ENTRIES_FORMAT_VERSION, key, count)
+    _save_binary(os.path.join(dir, FILE_ENTRIES_DATA), header, records, heap)
+
+
 def start_save_entries(dir, bucket_idx, morph_offset):
     _start_entries_as_module(os.path.join(dir, MODULE_ENTRIES_COMPACT % bucket_idx), morph_offset)
     _start_entries_as_module(os.path.join(dir, MODULE_ENTRIES_EXTRA % bucket_idx), morph_offset)
@@ -82,6 +168,94 @@ def save_connections(connections, dir='.'):
         offset += bucket_size
 
 
+def save_connections_binary(connections, key, dir='.'):
+    matrix = as_connection_matrix(connections)
+    costs = array('h', matrix.costs)
+    if sys.byteorder != 'little':
+        costs.byteswap()
+    header = CONNECTIONS_HEADER.pack(CONNECTIONS_MAGIC, CONNECTIONS_FORMAT_VERSION, key, matrix.height, matrix.width)
+    _save_binary(os.path.join(dir, FILE_CONNECTIONS_DATA), header, costs.tobytes())
+
+
+def read_binary_key(path, magic, version):
+    """
+    Source key in the header of a binary dictionary file,
+    or None if the file is missing or is not of the given magic and format version.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            head = fp.read(BINARY_PREFIX.size)
+    except OSError:
+        return None
+    if len(head) < BINARY_PREFIX.size:
+        return None
+    file_magic, file_version, key = BINARY_PREFIX.unpack(head)
+    if file_magic != magic or file_version != version:
+        return None
+    return key
+
+
+def save_snapshot(path, key, state):
+    """
+    Save state (wrap large buffers in pickle.PickleBuffer) as a snapshot file.
+    key is a 20-byte digest identifying the dictionary version the state was built from.
+    """
+    buffers = []
+    data = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+    pos = SNAPSHOT_HEADER.size + 16 * len(buffers) + len(data)
+    table = []
+    chunks = []
+    for buf in buffers:
+        raw = buf.raw()
+        padding = -pos % 8
+        chunks.append(b'\0' * padding)
+        pos += padding
+        table.extend((pos, raw.nbytes))
+        chunks.append(raw)
+        pos += raw.nbytes
+    body = [pack(f'<{len(table)}Q', *table), data] + chunks
+    digest = hashlib.sha1()
+    for chunk in body:
+        digest.update(chunk)
+    header = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT_VERSION, key, len(buffers), len(data),
+                                  pos, digest.digest())
+    _save_binary(path, header, *body)
+
+
+def load_snapshot(path, key):
+    """
+    Restore a state saved by save_snapshot.
+    Out-of-band buffers are memoryviews of the mapped file (no copy).
+    Returns None if the file is missing, truncated or corrupted (length or digest mismatch),
+    or was saved for another key.
+    """
+    try:
+        with open(path, 'rb') as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, saved_key, num_buffers, pickle_len, length, digest = SNAPSHOT_HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT_VERSION or saved_key != key \
+                or length != len(mm):
+            mm.close()
+            return None
+        view = memoryview(mm)
+        if hashlib.sha1(view[SNAPSHOT_HEADER.size:]).digest() != digest:
+            logger.warning(f'Dictionary snapshot is corrupted: {path}')
+            view.release()
+            mm.close()
+            return None
+        pos = SNAPSHOT_HEADER.size
+        table = unpack_from(f'<{2 * num_buffers}Q', mm, pos)
+        pos += 16 * num_buffers
+        buffers = [view[table[i]:table[i] + table[i + 1]] for i in range(0, len(table), 2)]
+        return pickle.loads(view[pos:pos + pickle_len], buffers=buffers)
+    except Exception:
+        logger.warning(f'Cannot load the dictionary snapshot: {path}')
+        return None
+
+
 def save_chardefs(chardefs, dir='.'):
     _save_as_module(os.path.join(dir, MODULE_CHARDEFS), chardefs)
 
@@ -114,6 +288,22 @@ def _load_package_data(package, resource):
     return zlib.decompress(rawdata, zlib.MAX_WBITS | 16)
 
 
+def _save_binary(file, *chunks):
+    # write to a temporary file first so that a reader never maps a partial file;
+    # the name is unique so that concurrent writers (e.g. worker processes starting cold) never collide
+    fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(file) or '.', prefix=os.path.basename(file) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for data in chunks:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
+
+
 def _save_as_module(file, data, binary=False):
     if not data:
         return
@@ -181,6 +371,63 @@ def _save_entry_as_module_extra(file, morph_id, entry):
             f.write('),')
 
 
+class ConnectionMatrix(object):
+    """
+    Connection cost matrix as a flat int16 sequence (row-major).
+    get(id1, id2) is a single flat index; matrix[id1][id2] is kept for compatibility.
+    """
+
+    def __init__(self, costs, height, width):
+        self.costs = costs
+        self.height = height
+        self.width = width
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from a list of lists of costs (the connections modules)"""
+        width = len(rows[0]) if rows else 0
+        costs = array('h')
+        for row in rows:
+            if len(row) != width:
+                raise ValueError('connection cost rows must have the same length')
+            costs.extend(row)
+        return cls(costs, len(rows), width)
+
+    @classmethod
+    def mmap(cls, path):
+        """Map a file written by save_connections_binary (read-only, no copy on little-endian machines)"""
+        with open(path, 'rb') as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _key, height, width = CONNECTIONS_HEADER.unpack_from(mm, 0)
+        if magic != CONNECTIONS_MAGIC or version != CONNECTIONS_FORMAT_VERSION \
+                or len(mm) != CONNECTIONS_HEADER.size + height * width * 2:
+            mm.close()
+            raise LoadingDictionaryError()
+        data = memoryview(mm)[CONNECTIONS_HEADER.size:]
+        if sys.byteorder == 'little':
+            costs = data.cast('h')
+        else:
+            costs = array('h', data.tobytes())
+            costs.byteswap()
+        return cls(costs, height, width)
+
+    def get(self, id1, id2):
+        return self.costs[id1 * self.width + id2]
+
+    def __len__(self):
+        return self.height
+
+    def __getitem__(self, id1):
+        start = id1 * self.width
+        return self.costs[start:start + self.width]
+
+
+def as_connection_matrix(connections):
+    if isinstance(connections, ConnectionMatrix):
+        return connections
+    return ConnectionMatrix.from_rows(connections)
+
+
 class Dictionary(ABC):
     """
     Base dictionary class
@@ -206,7 +453,7 @@ class RAMDictionary(Dictionary):
 
     def __init__(self, entries, connections):
         self.entries = entries
-        self.connections = connections
+        self.connections = as_connection_matrix(connections)
 
     def lookup(self, s, matcher):
         (matched, outputs) = matcher.run(s)
@@ -234,7 +481,7 @@ class RAMDictionary(Dictionary):
             sys.exit(1)
 
     def get_trans_cost(self, id1, id2):
-        return self.connections[id1][id2]
+        return self.connections.get(id1, id2)
 
 
 class MMapDictionary(Dictionary):
@@ -247,7 +494,7 @@ class MMapDictionary(Dictionary):
         self.bucket_ranges = entries_compact.keys()
         self.entries_extra = entries_extra
         self.open_files = open_files
-        self.connections = connections
+        self.connections = as_connection_matrix(connections)
 
     def lookup(self, s, matcher):
         (matched, outputs) = matcher.run(s)
@@ -317,7 +564,7 @@ class MMapDictionary(Dictionary):
             sys.exit(1)
 
     def get_trans_cost(self, id1, id2):
-        return self.connections[id1][id2]
+        return self.connections.get(id1, id2)
 
     def __del__(self):
         for mm, mm_idx in self.entries_compact.values():
@@ -329,6 +576,74 @@ class MMapDictionary(Dictionary):
             fp.close()
 
 
+class MMapEntries(object):
+    """
+    Read-only memory-mapped view of the binary entries file (see save_entries_binary)
+    """
+
+    def __init__(self, path):
+        self.fp = open(path, 'rb')
+        self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buf = memoryview(self.mm)
+        magic, version, _key, count = ENTRIES_HEADER.unpack_from(self.buf, 0)
+        if magic != ENTRIES_MAGIC or version != ENTRIES_FORMAT_VERSION:
+            self.close()
+            raise LoadingDictionaryError()
+        self.count = count
+        self.heap_start = ENTRIES_HEADER.size + count * ENTRIES_RECORD_SIZE
+
+    def _record_pos(self, idx):
+        if not 0 <= idx < self.count:
+            raise IndexError(f'morph id out of range: {idx}')
+        return ENTRIES_HEADER.size + idx * ENTRIES_RECORD_SIZE
+
+    def _str(self, offset, length):
+        start = self.heap_start + offset
+        return str(self.buf[start:start + length], 'utf8')
+
+    def entry(self, idx):
+        """(surface, left_id, right_id, cost)"""
+        surface_pos, surface_len, left_id, right_id, cost = \
+            ENTRIES_COMPACT_RECORD.unpack_from(self.buf, self._record_pos(idx))
+        return (self._str(surface_pos, surface_len), left_id, right_id, cost)
+
+    def extra(self, idx):
+        """(part_of_speech, infl_type, infl_form, base_form, reading, phonetic)"""
+        fields = ENTRIES_EXTRA_RECORD.unpack_from(self.buf, self._record_pos(idx) + ENTRIES_COMPACT_RECORD.size)
+        return tuple(self._str(fields[i], fields[i + 1]) for i in range(0, len(fields), 2))
+
+    def close(self):
+        self.buf.release()
+        self.mm.close()
+        self.fp.close()
+
+
+class BinaryMMapDictionary(MMapDictionary):
+    """
+    MMap dictionary class for the binary entries format.
+    Entries are read with fixed offsets; no delimiter scanning or unicode_escape decoding.
+    """
+
+    def __init__(self, entries, connections):
+        self.entries = entries
+        self.connections = as_connection_matrix(connections)
+
+    def _find_entry(self, idx):
+        return self.entries.entry(idx)
+
+    def lookup_extra(self, idx):
+        try:
+            return self.entries.extra(idx)
+        except Exception:
+            logger.error('Cannot load extra info. The dictionary may be corrupted?')
+            logger.error(f'idx={idx}')
+            traceback.format_exc()
+            sys.exit(1)
+
+    def __del__(self):
+        self.entries.close()
+
+
 class UnknownsDictionary(object):
     """
     Dictionary class for handling unknown words
@@ -13,11 +13,11 @@
 # limitations under the License.
 
 import copy
+from array import array
 from struct import pack, unpack
 from collections import OrderedDict
 import logging
 import threading
-from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.WARN)
@@ -324,16 +324,186 @@ def compileFST(fst):
     return b''.join(arcs)
 
 
+def read_arc(data, addr):
+    """
+    decode the arc at addr.
+    returns (flag, label, output, final_output, target, incr)
+    """
+    assert addr >= 0
+    # arc address
+    pos = addr
+    # the arc
+    label = 0
+    output = bytes()
+    final_output = [b'']
+    target = 0
+    # read flag
+    flag = data[pos]
+    pos += 1
+    if flag & FLAG_FINAL_ARC:
+        if flag & FLAG_ARC_HAS_FINAL_OUTPUT:
+            # read final outputs
+            final_output_count = unpack('I', data[pos:pos + 4])[0]
+            pos += 4
+            buf = []
+            for _ in range(final_output_count):
+                output_size = unpack('I', data[pos:pos + 4])[0]
+                pos += 4
+                if output_size:
+                    buf.append(bytes(data[pos:pos + output_size]))
+                    pos += output_size
+            final_output = buf
+    else:
+        # read label
+        label = data[pos]
+        pos += 1
+        if flag & FLAG_ARC_HAS_OUTPUT:
+            # read output
+            output_size = unpack('I', data[pos:pos + 4])[0]
+            pos += 4
+            output = bytes(data[pos:pos + output_size])
+            pos += output_size
+        # read target's (relative) address
+        target = unpack('I', data[pos:pos + 4])[0]
+        pos += 4
+    return flag, label, output, final_output, target, pos - addr
+
+
+# final outputs of a final arc without outputs (shared by all such arcs)
+EMPTY_FINAL_OUTPUT = (b'',)
+
+
+class ArcTable(object):
+    """
+    Decoded arcs of a compiled FST, as parallel typed arrays indexed by arc number.
+    States are decoded on first visit; the arcs of a state are stored contiguously
+    (the next arc of the same state is at index + 1) and targets are arc indexes
+    of the target state's first arc, so walking the FST needs no unpacking or hashing.
+    Outputs are not copied: an arc keeps the (offset, length) of its output in the
+    FST data, and the offset of its final-output block (0 if it has none).
+
+    Memory is bounded by the FST itself: an arc is decoded at most once, so the table
+    never holds more than the number of arcs in the data (about 22 bytes per arc for
+    the arrays, plus one state_index entry per decoded state).
+    """
+
+    END = -1         # target index meaning "past the end of the data"
+    UNRESOLVED = -2  # target index not looked up yet
+
+    def __init__(self, data):
+        self.data = data
+        self.data_len = len(data)
+        self.flags = array('B')
+        self.labels = array('B')
+        self.output_pos = array('I')
+        self.output_len = array('I')
+        self.final_pos = array('I')     # offset of the final-output block (0: no final outputs)
+        self.targets = array('i')       # arc index of the target state (UNRESOLVED until first traversal)
+        self.target_addrs = array('i')  # byte address of the target state (-1 for final arcs)
+        self.state_index = {}           # byte address of a state -> index of its first arc
+        self.lock = threading.Lock()
+        self.root = self._state(0)
+
+    def output(self, idx):
+        """output bytes of arc idx"""
+        pos = self.output_pos[idx]
+        return bytes(self.data[pos:pos + self.output_len[idx]])
+
+    def final_outputs(self, idx):
+        """final outputs of arc idx (decoded from the FST data on each call)"""
+        pos = self.final_pos[idx]
+        if not pos:
+            return EMPTY_FINAL_OUTPUT
+        data = self.data
+        count = unpack('I', data[pos:pos + 4])[0]
+        pos += 4
+        res = []
+        for _ in range(count):
+            size = unpack('I', data[pos:pos + 4])[0]
+            pos += 4
+            if size:
+                res.append(bytes(data[pos:pos + size]))
+                pos += size
+        return res
+
+    def resolve(self, idx):
+        """arc index of the target state of arc idx (decoded on first call)"""
+        target = self._state(self.target_addrs[idx])
+        self.targets[idx] = target
+        return target
+
+    def _state(self, addr):
+        first = self.state_index.get(addr)
+        if first is not None:
+            return first
+        if addr >= self.data_len:
+            return self.END
+        with self.lock:
+            first = self.state_index.get(addr)
+            if first is None:
+                first = self._decode_state(addr)
+                # publish the state only after all of its arcs are appended
+                self.state_index[addr] = first
+        return first
+
+    def _decode_state(self, addr):
+        data = self.data
+        first = len(self.flags)
+        pos = addr
+        while True:
+            # same layout as read_arc, but only offsets are recorded
+            start = pos
+            flag = data[pos]
+            pos += 1
+            label = 0
+            output_pos = output_len = final_pos = 0
+            target_addr = -1
+            if flag & FLAG_FINAL_ARC:
+                if flag & FLAG_ARC_HAS_FINAL_OUTPUT:
+                    final_pos = pos
+                    count = unpack('I', data[pos:pos + 4])[0]
+                    pos += 4
+                    for _ in range(count):
+                        pos += 4 + unpack('I', data[pos:pos + 4])[0]
+            else:
+                label = data[pos]
+                pos += 1
+                if flag & FLAG_ARC_HAS_OUTPUT:
+                    output_len = unpack('I', data[pos:pos + 4])[0]
+                    output_pos = pos + 4
+                    pos += 4 + output_len
+                target_addr = start + unpack('I', data[pos:pos + 4])[0]
+                pos += 4
+            last = flag & FLAG_LAST_ARC or pos >= self.data_len
+            if last:
+                # the state also ends at the end of the data
+                flag |= FLAG_LAST_ARC
+            self.flags.append(flag)
+            self.labels.append(label)
+            self.output_pos.append(output_pos)
+            self.output_len.append(output_len)
+            self.final_pos.append(final_pos)
+            self.target_addrs.append(target_addr)
+            self.targets.append(self.UNRESOLVED)
+            if last:
+                return first
+
+
 class Matcher(object):
-    def __init__(self, dict_data, max_cache_size=1024, max_cached_word_len=8):
+    def __init__(self, dict_data, max_cache_size=1024, max_cached_word_len=8, arc_tables=None):
         if dict_data:
             self.dict_data = dict_data
             self.dict_len = len(dict_data)
-            # bytes -> (position, final_outputs, outputs)
+            # bytes -> (arc index, final_outputs, outputs)
             self.cache = [OrderedDict() for _ in range(len(dict_data))]
             self.max_cache_size = max_cache_size
             self.max_cached_word_len = max_cached_word_len
             self.lock = threading.Lock()
+            self.arc_tables = arc_tables or [ArcTable(data) for data in dict_data]
+
+    def fork(self):
+        """new Matcher sharing the decoded arcs of this one (with its own prefix cache)"""
+        return Matcher(self.dict_data, self.max_cache_size, self.max_cached_word_len, self.arc_tables)
 
     def run(self, word, common_prefix_match=True):
         output = set()
@@ -344,99 +514,67 @@ class Matcher(object):
     def _run(self, word, data_num, common_prefix_match):
         outputs = set()
         buf = b''
-        i = pos = 0
-        data = self.dict_data[data_num]
-        word_len, data_len = len(word), len(data)
+        i = 0
+        table = self.arc_tables[data_num]
+        flags, labels, targets = table.flags, table.labels, table.targets
+        output_pos, output_len, final_pos = table.output_pos, table.output_len, table.final_pos
+        data = table.data
+        unresolved = ArcTable.UNRESOLVED
+        idx = table.root
+        word_len = len(word)
 
         # simple lru cache
         # any prefix is in cache?
         for j in range(min(word_len, self.max_cached_word_len), 2, -1):
             if word[:j] in self.cache[data_num]:
-                pos, outputs, buf = self.cache[data_num][word[:j]]
+                idx, outputs, buf = self.cache[data_num][word[:j]]
                 # move this entry to top
                 with self.lock:
                     del[self.cache[data_num][word[:j]]]
-                    self.cache[data_num][word[:j]] = (pos, set(outputs), buf)
+                    self.cache[data_num][word[:j]] = (idx, set(outputs), buf)
                 # A cached entry found. We can skip to the position.
                 i = j
                 break
 
-        while pos < data_len:
-            arc = self.next_arc(data, pos)
-            # arc[0]: flag
-            # arc[1]: label
-            # arc[2]: output
-            # arc[3]: final_output
-            # arc[4]: target
-            # arc[5]: incr
-            if arc[0] & FLAG_FINAL_ARC:
+        while idx >= 0:
+            flag = flags[idx]
+            if flag & FLAG_FINAL_ARC:
                 if common_prefix_match or i >= word_len:
-                    for out in arc[3]:
-                        outputs.add(buf + out)
-                if arc[0] & FLAG_LAST_ARC or i > word_len:
+                    if final_pos[idx]:
+                        for out in table.final_outputs(idx):
+                            outputs.add(buf + out)
+                    else:
+                        outputs.add(buf)
+                if flag & FLAG_LAST_ARC or i > word_len:
                     break
-                pos += arc[5]
+                idx += 1
                 if i < self.max_cached_word_len:
                     with self.lock:
                         # add to cache
-                        self.cache[data_num][word[:i]] = (pos, set(outputs), buf)
+                        self.cache[data_num][word[:i]] = (idx, set(outputs), buf)
                         # check cache size
                         if len(self.cache[data_num]) >= self.max_cache_size:
                             self.cache[data_num].popitem(last=False)
             elif i < word_len:
-                if word[i] == arc[1]:
-                    buf += arc[2]
+                if word[i] == labels[idx]:
+                    size = output_len[idx]
+                    if size:
+                        pos = output_pos[idx]
+                        buf += data[pos:pos + size]
                     i += 1
-                    pos += arc[4]
-                elif arc[0] & FLAG_LAST_ARC:
+                    target = targets[idx]
+                    idx = target if target != unresolved else table.resolve(idx)
+                elif flag & FLAG_LAST_ARC:
                     break
                 else:
-                    pos += arc[5]
+                    idx += 1
             else:   # i >= word_len
                 break
 
         return outputs
 
-    @lru_cache(maxsize=4096)
     def next_arc(self, data, addr):
-        assert addr >= 0
-        # arc address
-        pos = addr
-        # the arc
-        label = 0
-        output = bytes()
-        final_output = [b'']
-        target = 0
-        # read flag
-        flag = data[pos]
-        pos += 1
-        if flag & FLAG_FINAL_ARC:
-            if flag & FLAG_ARC_HAS_FINAL_OUTPUT:
-                # read final outputs
-                final_output_count = unpack('I', data[pos:pos + 4])[0]
-                pos += 4
-                buf = []
-                for _ in range(final_output_count):
-                    output_size = unpack('I', data[pos:pos + 4])[0]
-                    pos += 4
-                    if output_size:
-                        buf.append(data[pos:pos + output_size])
-                        pos += output_size
-                final_output = buf
-        else:
-            # read label
-            label = data[pos]
-            pos += 1
-            if flag & FLAG_ARC_HAS_OUTPUT:
-                # read output
-                output_size = unpack('I', data[pos:pos + 4])[0]
-                pos += 4
-                output = data[pos:pos + output_size]
-                pos += output_size
-            # read target's (relative) address
-            target = unpack('I', data[pos:pos + 4])[0]
-            pos += 4
-        return flag, label, output, final_output, target, pos - addr
+        return read_arc(data, addr)
 
 
 if __name__ == '__main__':
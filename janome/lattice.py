@@ -131,12 +131,15 @@ class Lattice(object):
         self.conn_costs = [[]]
         self.p = 1
         self.dic = dic
+        # flat connection cost table: cost(right_id, left_id) = trans_costs[right_id * trans_width + left_id]
+        self.trans_costs = dic.connections.costs
+        self.trans_width = dic.connections.width
 
     def add(self, node):
         min_cost, best_node, node_left_id = node.min_cost - node.cost, None, node.left_id
-        dic = self.dic
+        trans_costs, trans_width = self.trans_costs, self.trans_width
         for enode in self.enodes[self.p]:
-            cost = enode.min_cost + dic.get_trans_cost(enode.right_id, node_left_id)
+            cost = enode.min_cost + trans_costs[enode.right_id * trans_width + node_left_id]
             if cost < min_cost:
                 min_cost, best_node = cost, enode
             elif cost == min_cost \
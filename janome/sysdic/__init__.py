@@ -1,14 +1,17 @@
 # type: ignore
 import os, sys
+import bisect
+import threading
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
-from janome.dic import LoadingDictionaryError
-from . import connections1, connections2
+from janome.dic import LoadingDictionaryError, FILE_FST_DATA, FILE_ENTRIES_DATA, FILE_CONNECTIONS_DATA, \
+    FST_DATA_MAGIC, FST_DATA_FORMAT_VERSION, FST_DATA_HEADER, ENTRIES_MAGIC, ENTRIES_FORMAT_VERSION, \
+    CONNECTIONS_MAGIC, CONNECTIONS_FORMAT_VERSION, \
+    MMapEntries, ConnectionMatrix, save_fstdata_binary, save_entries_binary, save_connections_binary, \
+    read_binary_key, save_snapshot, load_snapshot
+from janome.version import JANOME_VERSION
 from . import chardef, unknowns
 
-connections = list(connections1.DATA)
-connections.extend(connections2.DATA)
-
 __entries = None
 
 def __add_extra_info(entries, extra_entries_info):
@@ -72,9 +75,9 @@ def entries(compact = False):
 
 def mmap_entries(compact = False):
     import mmap
-    from importlib import import_module
     from . import entries_buckets
 
+    entries_idx = warm_state('entries_idx')
     __mmap_entries_compact = {}
     __mmap_entries_extra = None
     __open_files = []
@@ -82,24 +85,314 @@ def mmap_entries(compact = False):
         bucket = entries_buckets.DATA[i]
         fp = open(os.path.join(base_dir, 'entries_compact%d.py' % i), 'rb')
         mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
-        mm_idx = import_module('.entries_compact%d_idx' % i, 'janome.sysdic')
         __open_files.append(fp)
-        __mmap_entries_compact[bucket] = (mm, mm_idx.DATA)
+        __mmap_entries_compact[bucket] = (mm, entries_idx['entries_compact%d_idx' % i])
     if not compact:
         __mmap_entries_extra = {}
         for i in range(0, 10):
             bucket = entries_buckets.DATA[i]
             fp = open(os.path.join(base_dir, 'entries_extra%d.py' % i), 'rb')
             mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
-            mm_idx = import_module('.entries_extra%d_idx' % i, 'janome.sysdic')
             __open_files.append(fp)
-            __mmap_entries_extra[bucket] = (mm, mm_idx.DATA)
+            __mmap_entries_extra[bucket] = (mm, entries_idx['entries_extra%d_idx' % i])
     return (__mmap_entries_compact, __mmap_entries_extra, __open_files)
 
+class LazyEntries(object):
+    """
+    System dictionary entries for the RAM dictionary, loaded per bucket on first access.
+    self[idx] gives (surface, left_id, right_id, cost) from entries_compact<N>;
+    extra(idx) gives the extra fields from entries_extra<N>, kept in a separate store
+    so that the entry tuples are never rebuilt.
+    """
+
+    def __init__(self):
+        from . import entries_buckets
+        buckets = sorted(entries_buckets.DATA.items(), key=lambda b: b[1][0])
+        self.bucket_nums = [num for num, _ in buckets]
+        self.bucket_starts = [r[0] for _, r in buckets]
+        self.bucket_ends = [r[1] for _, r in buckets]
+        self.compact = {}
+        self.extra_info = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, idx):
+        i = bisect.bisect_right(self.bucket_starts, idx) - 1
+        if i < 0 or idx >= self.bucket_ends[i]:
+            raise KeyError(idx)
+        return self.bucket_nums[i]
+
+    def _load(self, store, module_name, bucket):
+        data = store.get(bucket)
+        if data is None:
+            with self.lock:
+                data = store.get(bucket)
+                if data is None:
+                    from importlib import import_module
+                    try:
+                        data = import_module(module_name % bucket, 'janome.sysdic').DATA
+                    except (ImportError, AttributeError):
+                        raise LoadingDictionaryError()
+                    store[bucket] = data
+        return data
+
+    def __getitem__(self, idx):
+        return self._load(self.compact, '.entries_compact%d', self._bucket(idx))[idx]
+
+    def __len__(self):
+        return self.bucket_ends[-1] if self.bucket_ends else 0
+
+    def extra(self, idx):
+        return self._load(self.extra_info, '.entries_extra%d', self._bucket(idx))[idx]
+
+def lazy_entries():
+    return LazyEntries()
+
+def source_key(module_names):
+    """
+    Key of the binary files generated from `module_names`: the janome version and the size
+    of each module. Unlike file mtimes, it is kept when the files are copied or packaged.
+    """
+    import hashlib
+    h = hashlib.sha1(JANOME_VERSION.encode('utf8'))
+    for name in module_names:
+        h.update(('%s:%d;' % (name, os.path.getsize(os.path.join(base_dir, name)))).encode('utf8'))
+    return h.digest()
+
+def _binary_path(name, module_names, magic, version):
+    """
+    Path of a generated binary file, or None if it is missing, has another format version,
+    or was generated from other modules than the installed ones (source key mismatch).
+    If the modules are not installed (only the binary files were shipped), the file is used as is.
+    """
+    path = os.path.join(base_dir, name)
+    key = read_binary_key(path, magic, version)
+    if key is None:
+        return None
+    if all(os.path.exists(os.path.join(base_dir, m)) for m in module_names) and key != source_key(module_names):
+        return None
+    return path
+
+def _connection_rows():
+    from . import connections1, connections2
+    rows = list(connections1.DATA)
+    rows.extend(connections2.DATA)
+    return rows
+
+def load_connections():
+    """
+    Connection cost matrix. connections.bin is memory-mapped if available;
+    otherwise the connections modules are packed into an int16 array.
+    """
+    path = _connections_binary_path()
+    if path is not None:
+        try:
+            return ConnectionMatrix.mmap(path)
+        except (OSError, ValueError, LoadingDictionaryError):
+            pass
+    return warm_state('connections')
+
+CONNECTIONS_MODULES = ['connections1.py', 'connections2.py']
+ENTRIES_MODULES = ['entries_compact%d.py' % i for i in range(10)] + ['entries_extra%d.py' % i for i in range(10)]
+
+def _fstdata_modules(part):
+    return ['fst_data%d.py' % part]
+
+def _connections_binary_path():
+    return _binary_path(FILE_CONNECTIONS_DATA, CONNECTIONS_MODULES, CONNECTIONS_MAGIC, CONNECTIONS_FORMAT_VERSION)
+
+def _entries_binary_path():
+    return _binary_path(FILE_ENTRIES_DATA, ENTRIES_MODULES, ENTRIES_MAGIC, ENTRIES_FORMAT_VERSION)
+
+def _fstdata_binary_path(part):
+    return _binary_path(FILE_FST_DATA % part, _fstdata_modules(part), FST_DATA_MAGIC, FST_DATA_FORMAT_VERSION)
+
+def mmap_entries_binary():
+    """Open the binary entries file (entries.bin), or return None if it is not available."""
+    path = _entries_binary_path()
+    if path is None:
+        return None
+    return MMapEntries(path)
+
+FST_DATA_PARTS = 2
+
+__fstdata = None
+__fstdata_lock = threading.Lock()
+
 def all_fstdata():
+    """
+    Return the compiled FST data (one buffer per part), loaded at most once per process.
+    The raw binary files (fst_data*.bin) are memory-mapped read-only if present;
+    otherwise the data comes from the warm-start snapshot or the base64 modules.
+    """
+    global __fstdata
+    if __fstdata is None:
+        with __fstdata_lock:
+            if __fstdata is None:
+                __fstdata = _mmap_fstdata() or warm_state('fst')
+    return __fstdata
+
+def _mmap_fstdata_available():
+    return all(_fstdata_binary_path(i) for i in range(FST_DATA_PARTS))
+
+def _mmap_fstdata():
+    import mmap
+    res = []
+    for i in range(FST_DATA_PARTS):
+        path = _fstdata_binary_path(i)
+        try:
+            if path is None:
+                raise OSError('FST binary not available: %s' % (FILE_FST_DATA % i))
+            with open(path, 'rb') as fp:
+                # the mapping stays valid after the file is closed
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            # the FST data follows the header (the view keeps the mapping open)
+            res.append(memoryview(mm)[FST_DATA_HEADER.size:])
+        except (OSError, ValueError):
+            # missing, stale or empty file
+            for view in res:
+                view.obj.close()
+            return None
+    return res
+
+def _decode_fstdata_modules():
     import base64
-    from . import fst_data0,fst_data1
-    res=[]
-    res.append(base64.b64decode(fst_data0.DATA))
-    res.append(base64.b64decode(fst_data1.DATA))
+    from importlib import import_module
+    res = []
+    for i in range(FST_DATA_PARTS):
+        module = import_module('.fst_data%d' % i, 'janome.sysdic')
+        res.append(base64.b64decode(module.DATA))
+    return res
+
+SNAPSHOT_FILE = 'sysdic-%s.snapshot'
+
+def snapshot_path(part):
+    """
+    Path of the warm-start snapshot of `part`: $JANOME_SNAPSHOT_DIR (empty to disable) or ~/.cache/janome
+    """
+    dir = os.environ.get('JANOME_SNAPSHOT_DIR')
+    if dir is None:
+        dir = os.path.join(os.path.expanduser('~'), '.cache', 'janome')
+    return os.path.join(dir, SNAPSHOT_FILE % part) if dir else None
+
+def sysdic_version(parts):
+    """
+    Key of a snapshot holding `parts`: changes whenever a sysdic module is replaced
+    (size or mtime), or janome itself is upgraded.
+    """
+    import hashlib
+    h = hashlib.sha1(repr((JANOME_VERSION, sys.byteorder, base_dir, sorted(parts))).encode('utf8'))
+    for name in sorted(os.listdir(base_dir)):
+        if name.endswith('.py'):
+            st = os.stat(os.path.join(base_dir, name))
+            h.update(('%s:%d:%d;' % (name, st.st_size, st.st_mtime_ns)).encode('utf8'))
+    return h.digest()
+
+__warm_state = {}
+__warm_state_lock = threading.Lock()
+
+def warm_state(part):
+    """
+    Immutable state otherwise built from the sysdic modules at every startup:
+    'fst' (FST data), 'connections' (connection costs) or 'entries_idx' (the mmap entry indexes).
+    Each part is built only when it is first asked for, i.e. when its generated binary
+    file is not available. It is restored from the part's warm-start snapshot if that was
+    saved for the current sysdic version; otherwise it is built from the modules and
+    the snapshot is rewritten.
+    """
+    state = __warm_state.get(part)
+    if state is None:
+        with __warm_state_lock:
+            state = __warm_state.get(part)
+            if state is None:
+                state = _unpack_warm_state(_load_or_build_warm_state(part))[part]
+                __warm_state[part] = state
+    return state
+
+def _load_or_build_warm_state(part):
+    path = snapshot_path(part)
+    key = sysdic_version([part])
+    state = load_snapshot(path, key) if path else None
+    if state is None:
+        state = _build_warm_state([part])
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                save_snapshot(path, key, state)
+            except OSError:
+                pass  # read-only home etc.: start cold next time as well
+    return state
+
+def prewarm():
+    """
+    Prepare every part so that a new process (e.g. a pool worker started with spawn or
+    forkserver) can map it from a file instead of rebuilding it from the modules:
+    parts without a generated binary file get their warm-start snapshot written.
+    Returns False if some part would still have to be rebuilt (snapshots disabled or not writable).
+    """
+    binaries = {
+        'fst': _mmap_fstdata_available(),
+        'connections': _connections_binary_path() is not None,
+        'entries_idx': _entries_binary_path() is not None,
+    }
+    for part, has_binary in binaries.items():
+        if has_binary:
+            continue
+        path = snapshot_path(part)
+        if not path:
+            return False
+        if not os.path.exists(path):
+            _load_or_build_warm_state(part)
+            if not os.path.exists(path):
+                return False
+    return True
+
+def _build_warm_state(parts):
+    from array import array
+    from importlib import import_module
+    from pickle import PickleBuffer
+    state = {}
+    if 'fst' in parts:
+        state['fst'] = [PickleBuffer(data) for data in _decode_fstdata_modules()]
+    if 'connections' in parts:
+        matrix = ConnectionMatrix.from_rows(_connection_rows())
+        state['connections'] = (matrix.height, matrix.width, PickleBuffer(matrix.costs))
+    if 'entries_idx' in parts:
+        state['entries_idx'] = {}
+        for kind in ('compact', 'extra'):
+            for i in range(0, 10):
+                name = 'entries_%s%d_idx' % (kind, i)
+                data = import_module('.' + name, 'janome.sysdic').DATA
+                state['entries_idx'][name] = (data['offset'], PickleBuffer(array('I', data['positions'])))
+    return state
+
+def _view(buf, fmt):
+    # PickleBuffer (just built) or memoryview of the snapshot file (restored) -> typed memoryview
+    view = memoryview(buf).cast('B')
+    return view if fmt == 'B' else view.cast(fmt)
+
+def _unpack_warm_state(state):
+    res = {}
+    if 'fst' in state:
+        res['fst'] = [_view(buf, 'B') for buf in state['fst']]
+    if 'connections' in state:
+        height, width, buf = state['connections']
+        res['connections'] = ConnectionMatrix(_view(buf, 'h'), height, width)
+    if 'entries_idx' in state:
+        res['entries_idx'] = {
+            name: {'offset': offset, 'positions': _view(buf, 'I')}
+            for name, (offset, buf) in state['entries_idx'].items()
+        }
     return res
+
+def build_binary_files(dir=base_dir):
+    """
+    Convert the sysdic modules into binary files that can be memory-mapped at startup.
+    Run as `python -m janome.sysdic` (e.g. before packaging the app).
+    Each file stores the source key of its modules, so that it is ignored after the modules change.
+    """
+    for i, data in enumerate(_decode_fstdata_modules()):
+        save_fstdata_binary(data, source_key(_fstdata_modules(i)), dir, i)
+    save_connections_binary(_connection_rows(), source_key(CONNECTIONS_MODULES), dir)
+    save_entries_binary(entries(), source_key(ENTRIES_MODULES), dir)
+
+connections = load_connections()
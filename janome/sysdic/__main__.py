@@ -0,0 +1,5 @@
+# type: ignore
+# python -m janome.sysdic : generate the memory-mappable binary files from the sysdic modules
+from janome.sysdic import build_binary_files
+
+build_binary_files()
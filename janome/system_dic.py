@@ -12,10 +12,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import threading
+import traceback
 
-from .sysdic import entries, mmap_entries, connections, chardef, unknowns  # type: ignore
-from .dic import RAMDictionary, MMapDictionary, UnknownsDictionary
+from .sysdic import lazy_entries, mmap_entries, mmap_entries_binary, connections, chardef, unknowns  # type: ignore
+from .dic import RAMDictionary, MMapDictionary, BinaryMMapDictionary, UnknownsDictionary, LoadingDictionaryError, \
+    logger
 
 
 class SystemDictionary(RAMDictionary, UnknownsDictionary):
@@ -31,13 +34,24 @@ class SystemDictionary(RAMDictionary, UnknownsDictionary):
         if not cls.__INSTANCE:
             with cls.__lock:
                 if not cls.__INSTANCE:
-                    cls.__INSTANCE = SystemDictionary(entries(), connections, chardef.DATA, unknowns.DATA)
+                    # entry buckets are loaded on first lookup (see sysdic.LazyEntries)
+                    cls.__INSTANCE = SystemDictionary(lazy_entries(), connections, chardef.DATA, unknowns.DATA)
         return cls.__INSTANCE
 
     def __init__(self, entries, connections, chardefs, unknowns):
         RAMDictionary.__init__(self, entries, connections)
         UnknownsDictionary.__init__(self, chardefs, unknowns)
 
+    def lookup_extra(self, num):
+        if not hasattr(self.entries, 'extra'):
+            return RAMDictionary.lookup_extra(self, num)
+        try:
+            return self.entries.extra(num)
+        except Exception:
+            logger.error('Cannot load dictionary data. The dictionary may be corrupted?')
+            traceback.format_exc()
+            sys.exit(1)
+
 
 class MMapSystemDictionary(MMapDictionary, UnknownsDictionary):
     """
@@ -58,3 +72,34 @@ class MMapSystemDictionary(MMapDictionary, UnknownsDictionary):
     def __init__(self, mmap_entries, connections, chardefs, unknowns):
         MMapDictionary.__init__(self, mmap_entries[0], mmap_entries[1], mmap_entries[2], connections)
         UnknownsDictionary.__init__(self, chardefs, unknowns)
+
+
+class BinaryMMapSystemDictionary(BinaryMMapDictionary, UnknownsDictionary):
+    """
+    MMap System dictionary class for the binary entries format (entries.bin)
+    """
+
+    __INSTANCE = None
+    __lock = threading.Lock()
+
+    @classmethod
+    def available(cls):
+        if cls.__INSTANCE:
+            return True
+        with cls.__lock:
+            if not cls.__INSTANCE:
+                entries = mmap_entries_binary()
+                if entries is None:
+                    return False
+                cls.__INSTANCE = BinaryMMapSystemDictionary(entries, connections, chardef.DATA, unknowns.DATA)
+        return True
+
+    @classmethod
+    def instance(cls):
+        if not cls.available():
+            raise LoadingDictionaryError()
+        return cls.__INSTANCE
+
+    def __init__(self, entries, connections, chardefs, unknowns):
+        BinaryMMapDictionary.__init__(self, entries, connections)
+        UnknownsDictionary.__init__(self, chardefs, unknowns)
@@ -94,7 +94,7 @@ import os
 from typing import Iterator, Union, Tuple, Optional, Any
 from .lattice import Lattice, Node, SurfaceNode, BOS, EOS, NodeType  # type: ignore
 from .dic import UserDictionary, CompiledUserDictionary  # type: ignore
-from .system_dic import SystemDictionary, MMapSystemDictionary
+from .system_dic import SystemDictionary, MMapSystemDictionary, BinaryMMapSystemDictionary
 from .fst import Matcher
 
 try:
@@ -176,11 +176,14 @@ class Tokenizer(object):
 
         .. seealso:: http://mocobeta.github.io/janome/en/#use-with-user-defined-dictionary
         """
-        self.sys_dic: Union[SystemDictionary, MMapSystemDictionary]
+        self.sys_dic: Union[SystemDictionary, MMapSystemDictionary, BinaryMMapSystemDictionary]
         self.user_dic: Optional[Union[UserDictionary, CompiledUserDictionary]]
         self.wakati = wakati
         self.matcher = Matcher(all_fstdata())
-        if mmap:
+        if mmap and BinaryMMapSystemDictionary.available():
+            # compiled binary entries (python -m janome.sysdic)
+            self.sys_dic = BinaryMMapSystemDictionary.instance()
+        elif mmap:
             self.sys_dic = MMapSystemDictionary.instance()
         else:
             self.sys_dic = SystemDictionary.instance()
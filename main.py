@@ -1,6 +1,7 @@
 import logging
 import sys
 import os
+import time
 import traceback
 from datetime import datetime
 
@@ -41,25 +42,30 @@ except:
 # グローバル変数としてモジュールを保持
 modules = {}
 
+# 読み込むモジュール (この順に import する)
+APP_MODULES = (
+    "styles", "braille_logic", "braille_layout", "braille_pipeline", "stl_generator",
+    "history_manager", "word_index", "plate_canvas", "edit_history", "tokenizer_service",
+)
+
 def load_modules():
     """モジュールをインポートし、失敗したらエラーを投げる"""
     global modules
     try:
-        import styles
-        import braille_logic
-        import stl_generator
-        import history_manager
-        
-        modules['styles'] = styles
-        modules['braille_logic'] = braille_logic
-        modules['stl_generator'] = stl_generator
-        modules['history_manager'] = history_manager
+        import perf_trace
+        modules['perf_trace'] = perf_trace
+
+        # 起動時間の回帰を追えるよう、モジュールごとの import 時間を記録する
+        for name in APP_MODULES:
+            modules[name] = perf_trace.import_timed(name)
         logging.info("Modules loaded successfully.")
+        logging.info("Startup profile:\n" + perf_trace.tracer.report())
     except ImportError as e:
         logging.error(f"Module load failed: {e}")
         raise ImportError(f"Failed to load modules: {e}")
 
 def main(page: ft.Page):
+    main_started = time.perf_counter()
     print("--- Main Function Called ---") # コンソール強制出力
     logging.info("--- Main Function Called ---")
     logging.info(f"Platform: {page.platform}")
@@ -93,16 +99,17 @@ def main(page: ft.Page):
     TextStyles = modules['styles'].TextStyles
     ComponentStyles = modules['styles'].ComponentStyles
     BrailleConverter = modules['braille_logic'].BrailleConverter
-    SPACE_MARK = modules['braille_logic'].SPACE_MARK
-    DAKUTEN_MARK = modules['braille_logic'].DAKUTEN_MARK
-    HANDAKUTEN_MARK = modules['braille_logic'].HANDAKUTEN_MARK
-    NUM_INDICATOR = modules['braille_logic'].NUM_INDICATOR
-    FOREIGN_INDICATOR = modules['braille_logic'].FOREIGN_INDICATOR
-    YOON_MARK = modules['braille_logic'].YOON_MARK
-    YOON_DAKU_MARK = modules['braille_logic'].YOON_DAKU_MARK
-    YOON_HANDAKU_MARK = modules['braille_logic'].YOON_HANDAKU_MARK
+    LayoutEngine = modules['braille_layout'].LayoutEngine
+    LAYOUT_GREEDY = modules['braille_layout'].LAYOUT_GREEDY
+    LAYOUT_OPTIMAL = modules['braille_layout'].LAYOUT_OPTIMAL
+    braille_pipeline = modules['braille_pipeline']
     STLGenerator = modules['stl_generator'].STLGenerator
     HistoryManager = modules['history_manager'].HistoryManager
+    WordIndex = modules['word_index'].WordIndex
+    apply_edits = modules['word_index'].apply_edits
+    EditHistory = modules['edit_history'].EditHistory
+    plate_canvas = modules['plate_canvas']
+    tracer = modules['perf_trace'].tracer
 
     # --- アプリ設定 ---
     page.title = "Tenji P-Fab"
@@ -119,9 +126,24 @@ def main(page: ft.Page):
 
     # --- ロジック初期化 ---
     try:
-        converter = BrailleConverter()
+        # 辞書は画面を出した後に別スレッドで読み込む
+        # Web 版ではセッションごとに main が呼ばれるため、辞書と Tokenizer はプロセスで共有する
+        converter = BrailleConverter(
+            defer_load=True,
+            service=modules['tokenizer_service'].get_service() if page.web else None,
+        )
         stl_generator = STLGenerator()
-        history_manager = HistoryManager(page)
+        # モバイルのクライアントストレージは小さいので履歴を圧縮して保存する
+        # デスクトップ版では履歴を SQLite に保存する (上限なし・全文検索あり)
+        is_desktop = not page.web and page.platform in [
+            ft.PagePlatform.WINDOWS, ft.PagePlatform.MACOS, ft.PagePlatform.LINUX
+        ]
+        history_manager = HistoryManager(
+            page,
+            compress_history=page.platform in [ft.PagePlatform.IOS, ft.PagePlatform.ANDROID],
+            history_db_path=os.path.join(os.path.expanduser("~"), ".tenji_pfab_history.sqlite3") if is_desktop else None,
+        )
+        layout_engine = LayoutEngine()
     except Exception as e:
         msg = f"Logic Init Error:\n{str(e)}\n{traceback.format_exc()}"
         logging.error(msg)
@@ -131,24 +153,38 @@ def main(page: ft.Page):
     # 状態管理
     state = {
         "current_mapped_data": [],
-        "editing_index": -1
+        "word_index": WordIndex(),  # current_mapped_data の表記索引
+        "doc_version": 0,  # 内容が変わるたびに増やす (レイアウトキャッシュのキー)
+        "preview_window": (0, -1),  # プレビューに実体化しているプレートの範囲 (first, last)
+        "preview_plates": {},  # プレート番号 -> 実体化済みのコントロール
+        "editing_index": -1,
+        "reading_edits": {},  # 単語インデックス -> (表記, 読み) の手動修正 (履歴に保存する)
+        "edit_history": EditHistory(),  # 読みの修正の取り消し・やり直し
+        "fallback_converted": False,  # 辞書の読み込み前に簡易変換した内容を表示中か
+        "pending_restore": None,  # 辞書の読み込み後に復元する履歴 (読みの修正を含むもの)
     }
     
     settings = {
         "max_chars_per_line": 10,
         "max_lines_per_plate": 4,
         "plate_thickness": 0.6, 
-        "use_quick_save": False
+        "use_quick_save": False,
+        "layout_mode": LAYOUT_GREEDY
     }
 
     # UI参照用Ref
     txt_input_ref = ft.Ref[ft.TextField]()
     edit_field_ref = ft.Ref[ft.TextField]()
+    apply_all_ref = ft.Ref[ft.Checkbox]()
     chars_slider_ref = ft.Ref[ft.Slider]()
     lines_slider_ref = ft.Ref[ft.Slider]()
 
     thickness_slider_ref = ft.Ref[ft.Slider]()
     thickness_label_ref = ft.Ref[ft.Text]()
+    layout_switch_ref = ft.Ref[ft.Switch]()
+    layout_info_ref = ft.Ref[ft.Text]()
+    undo_button_ref = ft.Ref[ft.IconButton]()
+    redo_button_ref = ft.Ref[ft.IconButton]()
     chars_label_ref = ft.Ref[ft.Text]()
     lines_label_ref = ft.Ref[ft.Text]()
 
@@ -209,6 +245,9 @@ def main(page: ft.Page):
                 thickness_slider_ref.current.value = val
                 thickness_slider_ref.current.label = f"{val:.1f}mm"
                 if thickness_label_ref.current: thickness_label_ref.current.value = f"{val:.1f}mm"
+
+            if layout_switch_ref.current:
+                layout_switch_ref.current.value = settings["layout_mode"] == LAYOUT_OPTIMAL
             
             page.update()
         except Exception as e:
@@ -217,18 +256,60 @@ def main(page: ft.Page):
     # --- ログ表示機能 ---
     def show_debug_logs(e):
         log_content = "\n".join(list_handler.log_records)
+        perf_text = ft.Text(tracer.report(), size=10, font_family="monospace", selectable=True)
+
+        def refresh_perf(e=None):
+            perf_text.value = tracer.report()
+            perf_text.update()
+
+        def toggle_tracing(e):
+            tracer.enabled = e.control.value
+            logging.info(f"Tracing {'enabled' if tracer.enabled else 'disabled'}")
+
+        def clear_perf(e):
+            tracer.clear()
+            refresh_perf()
+
+        def copy_perf_json(e):
+            page.set_clipboard(tracer.to_json())
+            show_snackbar("計測結果(JSON)をコピーしました")
+
+        logs_tab = ft.Container(
+            content=ft.Column([
+                ft.Text(log_content, size=10, font_family="monospace", selectable=True),
+            ], scroll=ft.ScrollMode.AUTO),
+            bgcolor=ft.Colors.BLACK87,
+            padding=10,
+            border_radius=5,
+        )
+        # 処理段ごとの所要時間 (ミリ秒の p50 / p95 / 最大)
+        perf_tab = ft.Column([
+            ft.Switch(label="計測を有効にする", value=tracer.enabled, on_change=toggle_tracing),
+            ft.Container(
+                content=ft.Column([perf_text], scroll=ft.ScrollMode.AUTO),
+                bgcolor=ft.Colors.BLACK12,
+                padding=10,
+                border_radius=5,
+                expand=True,
+            ),
+            ft.Row([
+                ft.TextButton("Refresh", on_click=refresh_perf),
+                ft.TextButton("Clear", on_click=clear_perf),
+                ft.TextButton("Copy JSON", on_click=copy_perf_json),
+            ], wrap=True),
+        ])
         log_view = ft.AlertDialog(
             title=ft.Text("Debug Logs"),
-            content=ft.Column([
-                ft.Container(
-                    content=ft.Text(log_content, size=10, font_family="monospace", selectable=True),
-                    bgcolor=ft.Colors.BLACK87,
-                    padding=10,
-                    border_radius=5,
-                    width=300,
-                    height=300,
-                )
-            ], tight=True, scroll=ft.ScrollMode.AUTO),
+            content=ft.Tabs(
+                length=2,
+                selected_index=0,
+                width=300,
+                height=380,
+                content=ft.Column([
+                    ft.TabBar(tabs=[ft.Tab(label="Logs"), ft.Tab(label="Performance")]),
+                    ft.TabBarView(controls=[logs_tab, perf_tab], expand=True),
+                ], expand=True),
+            ),
             actions=[
                 ft.TextButton("Copy", on_click=lambda e: page.set_clipboard(log_content)),
                 ft.TextButton("Close", on_click=lambda e: close_dialog(log_view))
@@ -236,6 +317,21 @@ def main(page: ft.Page):
         )
         open_dialog(log_view)
 
+    # アプリがバックグラウンドに回る・閉じるときは保存待ちの変更を書き出す
+    def on_app_lifecycle_change(e):
+        try:
+            history_manager.flush()
+        except Exception as ex:
+            logging.warning(f"History Flush Warning: {ex}")
+
+    page.on_app_lifecycle_state_change = on_app_lifecycle_change
+
+    # --- 読みの上書き (ユーザー辞書) のロード ---
+    try:
+        converter.update_reading_overrides(history_manager.get_reading_overrides())
+    except Exception as e:
+        logging.warning(f"Reading Overrides Load Warning: {e}")
+
     # --- 設定ロード ---
     try:
         saved_config = history_manager.load_settings()
@@ -249,64 +345,69 @@ def main(page: ft.Page):
 
     # --- UI Components ---
     
-    braille_display_area = ft.Column(scroll=ft.ScrollMode.AUTO, spacing=10)
+    # プレビューは仮想化する: 見えているプレートの前後だけコントロールを作り、
+    # それ以外は上下のスペーサー (高さだけ持つ空の Container) で置き換える
+    PREVIEW_OVERSCAN = 1  # 表示範囲の前後に余分に作っておくプレート数
+    PREVIEW_INITIAL = 3  # スクロール位置が分かる前に作るプレート数
+    preview_top_spacer = ft.Container(height=0)
+    preview_bottom_spacer = ft.Container(height=0)
 
-    def _make_dot(is_active):
-        return ft.Container(
-            width=8, height=8,
-            bgcolor=AppColors.DOT_ACTIVE if is_active else AppColors.DOT_INACTIVE,
-            border_radius=ft.BorderRadius(4, 4, 4, 4),
-        )
+    def on_preview_scroll(e):
+        update_preview_window(e.pixels, e.viewport_dimension)
+
+    braille_display_area = ft.ListView(spacing=0, expand=True, on_scroll=on_preview_scroll)
 
     # --- ロジック群 ---
-    def split_cells_with_rules(all_cells, max_chars):
-        lines = []
-        current_line = []
-        units = []
-        i = 0
-        prefix_marks_vals = {
-            tuple(DAKUTEN_MARK), tuple(HANDAKUTEN_MARK), tuple(YOON_MARK),
-            tuple(YOON_DAKU_MARK), tuple(YOON_HANDAKU_MARK), tuple(NUM_INDICATOR), tuple(FOREIGN_INDICATOR)
-        }
-        
-        while i < len(all_cells):
-            cell = all_cells[i]
-            cell_dots_tuple = tuple(cell['dots'])
-            is_prefix = (cell_dots_tuple in prefix_marks_vals)
-            
-            if is_prefix and i + 1 < len(all_cells):
-                units.append([cell, all_cells[i+1]])
-                i += 2
-            else:
-                units.append([cell])
-                i += 1
-                
-        for unit in units:
-            unit_len = len(unit)
-            if len(current_line) + unit_len > max_chars:
-                if len(current_line) > 0:
-                    lines.append(current_line)
-                    current_line = []
-            current_line.extend(unit)
-        if current_line:
-            lines.append(current_line)
-        return lines
+    def set_mapped_data(mapped_data):
+        """mapped data を差し替え、表記索引を作り直す"""
+        state["current_mapped_data"] = mapped_data
+        state["word_index"].rebuild(mapped_data)
+        state["doc_version"] += 1
+
+    def get_layout_pages():
+        """
+        現在の文書と設定のレイアウト (内容・設定が変わっていなければキャッシュを返す)
+        プレートは参照された時点でレイアウトされる
+        """
+        return layout_engine.paged_document(
+            state["current_mapped_data"], state["doc_version"],
+            settings["max_chars_per_line"], settings["max_lines_per_plate"],
+            settings["layout_mode"],
+        )
 
     def save_reading_edit(e):
         try:
             if state["editing_index"] < 0: return
             new_reading = edit_field_ref.current.value
             
+            surface = state["current_mapped_data"][state["editing_index"]]['orig']
+
+            # 「すべて修正」の場合は索引から同じ表記の全出現箇所を引く
+            if apply_all_ref.current and apply_all_ref.current.value:
+                indices = state["word_index"].find(surface)
+            else:
+                indices = [state["editing_index"]]
+
             # 【修正点1】空文字も許容するように条件を変更（if new_reading: を削除）
             # 空文字の場合、kana_to_cells は空リストを返すので点字も消えます
-            state["current_mapped_data"][state["editing_index"]]['reading'] = new_reading
             new_cells = converter.kana_to_cells(new_reading)
-            state["current_mapped_data"][state["editing_index"]]['cells'] = new_cells
-            state["current_mapped_data"][state["editing_index"]]['braille'] = [c['dots'] for c in new_cells]
+            # 修正前の読みを差分として記録しておき、取り消せるようにする
+            prev_override = history_manager.get_reading_overrides().get(surface)
+            state["edit_history"].apply(
+                state["current_mapped_data"], state["reading_edits"],
+                indices, surface, new_reading, new_cells, prev_override,
+            )
+            state["doc_version"] += 1
+
+            # 修正を表記 -> 読みの上書きとして記録し、以降の変換にも適用する
+            set_reading_override(surface, new_reading)
             
             render_braille_preview()
+            update_undo_buttons()
             
             msg = "読みを修正しました" if new_reading else "読みを消去しました"
+            if len(indices) > 1:
+                msg += f" ({len(indices)}箇所)"
             show_snackbar(msg)
             close_dialog(edit_dialog)
             
@@ -314,10 +415,60 @@ def main(page: ft.Page):
             logging.error(f"Save reading error: {ex}")
             show_snackbar("エラーが発生しました", is_error=True)
 
+    def set_reading_override(surface, reading):
+        """表記 -> 読みの上書きを保存し、変換器に反映する (reading が None なら上書きを消す)"""
+        try:
+            if reading is None:
+                overrides = history_manager.remove_reading_override(surface)
+            else:
+                overrides = history_manager.set_reading_override(surface, reading)
+            converter.update_reading_overrides(overrides)
+        except Exception as oe:
+            logging.error(f"Reading Override Save Error: {oe}")
+
+    def update_undo_buttons():
+        history = state["edit_history"]
+        for ref, enabled in ((undo_button_ref, history.can_undo), (redo_button_ref, history.can_redo)):
+            if ref.current and ref.current.disabled == enabled:
+                ref.current.disabled = not enabled
+                ref.current.update()
+
+    def undo_reading_edit(e):
+        try:
+            edit = state["edit_history"].undo(state["current_mapped_data"], state["reading_edits"])
+            if edit is None:
+                return
+            state["doc_version"] += 1
+            set_reading_override(edit.surface, edit.prev_override)
+            # 差分のあった行だけが描き直される
+            render_braille_preview()
+            update_undo_buttons()
+            show_snackbar(f"「{edit.surface}」の修正を取り消しました")
+        except Exception as ex:
+            logging.error(f"Undo error: {ex}")
+            show_snackbar("エラーが発生しました", is_error=True)
+
+    def redo_reading_edit(e):
+        try:
+            edit = state["edit_history"].redo(state["current_mapped_data"], state["reading_edits"])
+            if edit is None:
+                return
+            state["doc_version"] += 1
+            set_reading_override(edit.surface, edit.reading)
+            render_braille_preview()
+            update_undo_buttons()
+            show_snackbar(f"「{edit.surface}」の修正をやり直しました")
+        except Exception as ex:
+            logging.error(f"Redo error: {ex}")
+            show_snackbar("エラーが発生しました", is_error=True)
+
     # 編集ダイアログ定義
     edit_dialog = ft.AlertDialog(
         title=ft.Text("読みの修正"),
-        content=ft.TextField(ref=edit_field_ref, autofocus=True, label="読み（ひらがな）"),
+        content=ft.Column([
+            ft.TextField(ref=edit_field_ref, autofocus=True, label="読み（ひらがな）"),
+            ft.Checkbox(ref=apply_all_ref, value=False, visible=False),
+        ], tight=True),
         actions=[
             ft.TextButton("キャンセル", on_click=lambda e: close_dialog(edit_dialog)),
             ft.TextButton("保存", on_click=save_reading_edit),
@@ -330,94 +481,152 @@ def main(page: ft.Page):
         edit_dialog.title = ft.Text(f"「{item['orig']}」の読みを修正")
         if edit_field_ref.current:
             edit_field_ref.current.value = item['reading']
+        if apply_all_ref.current:
+            # 同じ表記が複数ある場合のみ一括修正を選べるようにする
+            count = len(state["word_index"].find(item['orig']))
+            apply_all_ref.current.label = f"同じ語をすべて修正 ({count}箇所)"
+            apply_all_ref.current.value = False
+            apply_all_ref.current.visible = count > 1
         open_dialog(edit_dialog)
 
-    def render_braille_preview():
+    def build_plate_ui(plate_num, plate_view):
+        # 寸法は plate_canvas.plate_height と揃える
+        return ft.Column([
+            ft.Text(f"Plate #{plate_num}", style=TextStyles.PLATE_LABEL, height=plate_canvas.LABEL_HEIGHT),
+            ft.Container(
+                content=plate_view.control,
+                padding=plate_canvas.FRAME_PADDING,
+                bgcolor=ft.Colors.WHITE54,
+                border_radius=ft.BorderRadius(8, 8, 8, 8),
+                border=ft.Border.all(plate_canvas.FRAME_BORDER, ft.Colors.BLACK12)
+            ),
+        ], spacing=plate_canvas.LABEL_SPACING)
+
+    def plate_extent():
+        """プレビュー上のプレート1枚分の高さ (スクロール位置からプレート番号を求めるのに使う)"""
+        return plate_canvas.plate_height(int(settings["max_lines_per_plate"]))
+
+    def build_preview_plate(plate_num, plate_lines):
+        """プレビュー用のプレート (高さ固定の枠, 行を差し替えるための PlateView) を作る"""
+        # 各行は1つの Canvas に描く (セルごとのコントロールは作らない)
+        with tracer.span("controls"):
+            plate_view = plate_canvas.PlateView(plate_lines, open_edit_dialog)
+            wrapper = ft.Container(
+                content=build_plate_ui(plate_num, plate_view),
+                height=plate_extent(),
+                clip_behavior=ft.ClipBehavior.HARD_EDGE,
+            )
+        return wrapper, plate_view
+
+    def send_updates(controls):
+        """変化のあったコントロールだけに update() を送る"""
+        with tracer.span("page_update"):
+            for control in controls:
+                control.update()
+
+    def show_preview_window(first, last, total, refresh=False):
+        """
+        first..last 番目のプレートだけ実体化し、範囲外のコントロールは手放す。
+        refresh の場合は実体化済みのプレートを新しいレイアウトと突き合わせ、変わった行だけ差し替える。
+        update() を送る必要のあるコントロールのリストを返す。
+        """
+        pages = get_layout_pages()
+        extent = plate_extent()
+        old = state["preview_plates"]
+        plates = {}
+        dirty = []
+        for n in range(first, last + 1):
+            entry = old.get(n)
+            if entry is None or entry[0].height != extent:
+                entry = build_preview_plate(n + 1, pages.plate(n))
+            elif refresh:
+                plate_lines = pages.plate(n)
+                with tracer.span("controls"):
+                    dirty.extend(entry[1].patch(plate_lines))
+            plates[n] = entry
+        state["preview_plates"] = plates
+        state["preview_window"] = (first, last)
+
+        top_height = first * extent
+        bottom_height = max(0, total - 1 - last) * extent
+        controls = [preview_top_spacer] + [plates[n][0] for n in range(first, last + 1)] + [preview_bottom_spacer]
+        same = (
+            top_height == preview_top_spacer.height
+            and bottom_height == preview_bottom_spacer.height
+            and len(controls) == len(braille_display_area.controls)
+            and all(a is b for a, b in zip(controls, braille_display_area.controls))
+        )
+        if same:
+            return dirty
+        # プレートの並びが変わったときは一覧ごと送る (既存のプレートは使い回される)
+        preview_top_spacer.height = top_height
+        preview_bottom_spacer.height = bottom_height
+        braille_display_area.controls = controls
+        return [braille_display_area]
+
+    def fit_preview_window(pages, first, last):
+        """
+        first..last を文書のプレート数に収め、(first, last, 総数の見込み) を返す。
+        行の区切りは last まで求めるだけで、文書の最後までは求めない
+        (下のスペーサーは見込みの枚数で作り、スクロールに合わせて伸び縮みさせる)。
+        """
+        if not pages.has_plate(last):
+            # 文書の終わりを越えている (ここで区切りは最後まで求め終わっている)
+            last = pages.estimated_count() - 1
+            first = max(0, min(first, last))
+        return first, last, pages.estimated_count()
+
+    def update_preview_window(pixels, viewport):
         try:
-            braille_display_area.controls.clear()
-            
-            flat_cells_all = []
-            
-            # 【修正点2】中身が空のアイテム（消去された単語）を除外したインデックスリストを作成
-            # これにより、空の単語の前後に無駄なスペースが入るのを防ぎます
-            valid_indices = [
-                i for i, item in enumerate(state["current_mapped_data"]) 
-                if item['cells'] and len(item['cells']) > 0
-            ]
-            
-            for i, word_idx in enumerate(valid_indices):
-                item = state["current_mapped_data"][word_idx]
-                
-                # 点字セルを追加
-                for cell in item['cells']:
-                    flat_cells_all.append({
-                        'dots': cell['dots'],
-                        'char': cell['char'],
-                        'word_idx': word_idx, # クリック時のために元のインデックスを保持
-                        'orig': item['orig']
-                    })
-                
-                # 最後の有効な単語でなければスペースを追加
-                if i < len(valid_indices) - 1:
-                    flat_cells_all.append({
-                        'dots': SPACE_MARK, 'char': ' ', 'word_idx': -1, 'orig': '(Space)'
-                    })
-            
-            chars_per_line = int(settings["max_chars_per_line"])
-            lines_per_plate = int(settings["max_lines_per_plate"])
-            
-            lines = split_cells_with_rules(flat_cells_all, chars_per_line)
-            plates = [lines[i:i + lines_per_plate] for i in range(0, len(lines), lines_per_plate)]
+            pages = get_layout_pages()
+            extent = plate_extent()
+            first = max(0, int(pixels // extent) - PREVIEW_OVERSCAN)
+            last = int((pixels + viewport) // extent) + PREVIEW_OVERSCAN
+            first, last, total = fit_preview_window(pages, first, last)
+            if total == 0:
+                return
+            if (first, last) == state["preview_window"]:
+                return
+            send_updates(show_preview_window(first, last, total))
+        except Exception as e:
+            logging.error(f"Render Error: {e}")
 
-            for i, plate_lines in enumerate(plates):
-                plate_num = i + 1
-                plate_content_controls = []
-                
-                for line_cells in plate_lines:
-                    row_controls = []
-                    for cell_info in line_cells:
-                        cell_dots = cell_info['dots']
-                        char_str = cell_info['char']
-                        word_idx = cell_info['word_idx']
-                        
-                        col1 = ft.Column(spacing=2, controls=[_make_dot(cell_dots[0]), _make_dot(cell_dots[1]), _make_dot(cell_dots[2])])
-                        col2 = ft.Column(spacing=2, controls=[_make_dot(cell_dots[3]), _make_dot(cell_dots[4]), _make_dot(cell_dots[5])])
-                        
-                        cell_ui = ft.Container(
-                            content=ft.Column([
-                                ft.Container(
-                                    content=ft.Row([col1, col2], spacing=2),
-                                    padding=4,
-                                    bgcolor=AppColors.SURFACE,
-                                    border_radius=ft.BorderRadius(4, 4, 4, 4),
-                                    shadow=ft.BoxShadow(blur_radius=1, color=ft.Colors.with_opacity(0.1, "#000000")),
-                                ),
-                                ft.Text(char_str, style=TextStyles.READING, text_align=ft.TextAlign.CENTER, width=20)
-                            ], spacing=2, alignment=ft.MainAxisAlignment.CENTER),
-                            on_click=lambda e, idx=word_idx: open_edit_dialog(idx) if idx != -1 else None,
-                        )
-                        row_controls.append(cell_ui)
-                    
-                    plate_content_controls.append(
-                        ft.Row(row_controls, spacing=8, alignment=ft.MainAxisAlignment.START, scroll=ft.ScrollMode.ALWAYS)
-                    )
+    def clear_braille_preview():
+        state["preview_plates"] = {}
+        state["preview_window"] = (0, -1)
+        braille_display_area.controls.clear()
 
-                plate_ui = ft.Column([
-                    ft.Text(f"Plate #{plate_num}", style=TextStyles.PLATE_LABEL),
-                    ft.Container(
-                        content=ft.Column(plate_content_controls, spacing=10),
-                        padding=10, 
-                        bgcolor=ft.Colors.WHITE54,
-                        border_radius=ft.BorderRadius(8, 8, 8, 8),
-                        border=ft.Border.all(1, ft.Colors.BLACK12)
-                    ),
-                ], spacing=2)
-                braille_display_area.controls.append(plate_ui)
-            page.update()
+    def render_braille_preview():
+        try:
+            # 見えている範囲を新しいレイアウトと突き合わせ、変わった行だけ差し替える
+            pages = get_layout_pages()
+            first, last = state["preview_window"]
+            if last < first:
+                first, last = 0, PREVIEW_INITIAL - 1
+            # 文書が短くなった場合は範囲を収まるように詰める
+            first, last, total = fit_preview_window(pages, first, last)
+            if total == 0:
+                clear_braille_preview()
+                send_updates([braille_display_area])
+            else:
+                send_updates(show_preview_window(first, last, total, refresh=True))
         except Exception as e:
             logging.error(f"Render Error: {e}")
             show_snackbar("描画エラーが発生しました", is_error=True)
 
+    def show_streamed_plate(plate_lines):
+        """変換途中に先頭のプレートだけ先に反映する"""
+        entry = state["preview_plates"].get(0)
+        if entry is not None:
+            with tracer.span("controls"):
+                dirty = entry[1].patch(plate_lines)
+            send_updates(dirty)
+        elif not braille_display_area.controls:
+            wrapper, plate_view = build_preview_plate(1, plate_lines)
+            state["preview_plates"] = {0: (wrapper, plate_view)}
+            braille_display_area.controls = [wrapper]
+            send_updates([braille_display_area])
+
     # --- 履歴・保存 ---
     def restore_history_item(item):
         try:
@@ -434,9 +643,37 @@ def main(page: ft.Page):
             if txt_input_ref.current:
                 txt_input_ref.current.value = restored_text
 
-            # 編集済みデータがあればそれを使う（手動修正を復元）
-            if item.get("mapped_data"):
-                state["current_mapped_data"] = item["mapped_data"]
+            state["pending_restore"] = None
+            if (item.get("edits") or item.get("mapped_data")) and not converter.is_ready:
+                # 修正は辞書での変換結果に対するものなので、読み込みが終わってから当てる
+                # (それまでは簡易変換を表示し、画面は止めない)
+                state["pending_restore"] = item
+                update_braille_from_input(restored_text)
+                if not converter.is_ready:
+                    show_snackbar("辞書の読み込み後に読みの修正を復元します")
+                    return
+                # 簡易変換の間に読み込みが終わった場合はこのまま復元する
+                state["pending_restore"] = None
+            # 手動修正があれば、テキストを変換し直してから修正を当てる
+            if item.get("edits") or item.get("mapped_data"):
+                mapped_data = converter.convert_with_mapping(restored_text)
+                if item.get("edits"):
+                    edits = apply_edits(converter, mapped_data, item["edits"])
+                else:
+                    # 旧形式 (点字データ全体を保存) の履歴は、変換結果と読みが違う箇所を修正とみなす
+                    legacy = item["mapped_data"]
+                    edits = {
+                        idx: (word['orig'], word['reading'])
+                        for idx, word in enumerate(legacy)
+                        if idx < len(mapped_data) and mapped_data[idx]['orig'] == word['orig']
+                        and mapped_data[idx]['reading'] != word['reading']
+                    }
+                    apply_edits(converter, mapped_data, [[idx, o, r] for idx, (o, r) in edits.items()])
+                set_mapped_data(mapped_data)
+                state["reading_edits"] = edits
+                state["edit_history"].clear()
+                update_undo_buttons()
+                state["fallback_converted"] = False
                 render_braille_preview()
             else:
                 update_braille_from_input(restored_text)
@@ -447,29 +684,67 @@ def main(page: ft.Page):
             traceback.print_exc()
             show_snackbar("復元に失敗しました", is_error=True)
 
+    HISTORY_PAGE_SIZE = 20  # 履歴ダイアログに一度に読み込む件数
+
     def show_history_dialog(e):
         try:
-            history_list = history_manager.get_history()
-            if not history_list:
-                content = ft.Text("履歴はありません", text_align=ft.TextAlign.CENTER)
-            else:
-                list_items = []
-                for idx, item in enumerate(history_list):
-                    preview_text = item.get("text", "")[:15] + "..." if len(item.get("text", "")) > 15 else item.get("text", "")
-                    meta_info = f"{item.get('timestamp')} | {item.get('max_chars_per_line')}文字/{item.get('max_lines_per_plate')}行/{item.get('plate_thickness')}mm"
-                    list_items.append(
-                        ft.ListTile(
-                            leading=ft.Icon(ft.Icons.HISTORY),
-                            title=ft.Text(preview_text, weight=ft.FontWeight.BOLD),
-                            subtitle=ft.Text(meta_info, size=12),
-                            on_click=lambda e, it=item: [restore_history_item(it), close_dialog(history_dlg)]
-                        )
+            # 検索語と次のページの位置 (新しい順にページ単位で読み込む)
+            history_query = {"text": "", "cursor": None}
+            history_column = ft.Column(scroll=ft.ScrollMode.AUTO, height=300)
+
+            def history_tile(item):
+                preview_text = item.get("text", "")[:15] + "..." if len(item.get("text", "")) > 15 else item.get("text", "")
+                meta_info = f"{item.get('timestamp')} | {item.get('max_chars_per_line')}文字/{item.get('max_lines_per_plate')}行/{item.get('plate_thickness')}mm"
+                return ft.ListTile(
+                    leading=ft.Icon(ft.Icons.HISTORY),
+                    title=ft.Text(preview_text, weight=ft.FontWeight.BOLD),
+                    subtitle=ft.Text(meta_info, size=12),
+                    on_click=lambda e, it=item: [restore_history_item(it), close_dialog(history_dlg)]
+                )
+
+            def load_history_page(append=False):
+                cursor = history_query["cursor"] if append else None
+                items, next_cursor = history_manager.search_history(history_query["text"], cursor, HISTORY_PAGE_SIZE)
+                if append:
+                    # 末尾の「さらに表示」ボタンを外して続きを足す
+                    history_column.controls.pop()
+                else:
+                    history_column.controls.clear()
+                history_column.controls.extend(history_tile(item) for item in items)
+                if not history_column.controls:
+                    message = "見つかりません" if history_query["text"] else "履歴はありません"
+                    history_column.controls.append(ft.Text(message, text_align=ft.TextAlign.CENTER))
+                if next_cursor is not None:
+                    history_column.controls.append(
+                        ft.TextButton("さらに表示", icon=ft.Icons.EXPAND_MORE, on_click=lambda e: show_more_history())
                     )
-                content = ft.Column(list_items, scroll=ft.ScrollMode.AUTO, height=300)
-            
+                history_query["cursor"] = next_cursor
+
+            def show_more_history():
+                try:
+                    load_history_page(append=True)
+                    history_column.update()
+                except Exception as ex:
+                    logging.error(f"History Page Error: {ex}")
+
+            def on_history_search(e):
+                try:
+                    history_query["text"] = (e.control.value or "").strip()
+                    load_history_page()
+                    history_column.update()
+                except Exception as ex:
+                    logging.error(f"History Search Error: {ex}")
+
+            load_history_page()
             history_dlg = ft.AlertDialog(
-                title=ft.Text("保存履歴 (最新50件)"),
-                content=content,
+                title=ft.Text("保存履歴"),
+                content=ft.Column([
+                    ft.TextField(
+                        label="本文を検索", prefix_icon=ft.Icons.SEARCH, dense=True,
+                        on_change=on_history_search,
+                    ),
+                    history_column,
+                ], tight=True, width=320),
                 actions=[
                     ft.TextButton("閉じる", on_click=lambda e: close_dialog(history_dlg)),
                     ft.TextButton("履歴クリア", on_click=lambda e: [history_manager.clear_history(), close_dialog(history_dlg), show_snackbar("履歴を消去しました")])
@@ -480,39 +755,57 @@ def main(page: ft.Page):
             logging.error(f"History Dialog Error: {ex}")
             show_snackbar("履歴読み込みエラー", is_error=True)
 
+    def on_input_change(e):
+        # 入力し直した場合は、読み込み待ちの履歴の復元は取りやめる
+        state["pending_restore"] = None
+        update_braille_from_input(e.control.value)
+
     def update_braille_from_input(text):
+        # 入力1回分の処理全体を計測する
+        with tracer.span("keystroke"):
+            convert_and_render(text)
+
+    def convert_and_render(text):
         try:
             if not text:
-                state["current_mapped_data"] = []
-                braille_display_area.controls.clear()
-                page.update()
+                set_mapped_data([])
+                clear_braille_preview()
+                send_updates([braille_display_area])
+                return
+            # 変換し直すと単語の並びが変わりうるので、手動修正は引き継がない
+            state["reading_edits"] = {}
+            if state["edit_history"].can_undo or state["edit_history"].can_redo:
+                state["edit_history"].clear()
+                update_undo_buttons()
+            # 辞書の読み込み中は簡易変換になる (読み込み後に変換し直す)
+            state["fallback_converted"] = not converter.is_ready
+            if settings["layout_mode"] == LAYOUT_OPTIMAL:
+                # 最適改行は文書全体を見て決めるため、変換後にまとめてレイアウトする
+                set_mapped_data(converter.convert_with_mapping(text))
+                render_braille_preview()
                 return
-            state["current_mapped_data"] = converter.convert_with_mapping(text)
+            # 先頭のプレートだけ変換しながらレイアウトして表示する (変換完了を待たない)
+            mapped_data = []
+            state["current_mapped_data"] = mapped_data
+            entries = braille_pipeline.iter_word_entries(converter, text, sink=mapped_data)
+            first_plate = next(braille_pipeline.iter_entry_plates(
+                entries, settings["max_chars_per_line"], settings["max_lines_per_plate"],
+            ), None)
+            if first_plate is not None:
+                show_streamed_plate(first_plate)
+            # 残りは変換だけ済ませる (2枚目以降のプレートは表示・書き出しで参照された時点でレイアウトする)
+            for _ in entries:
+                pass
+            set_mapped_data(mapped_data)
+            # 見えている範囲だけ、表示中のプレートとの差分を反映する
             render_braille_preview()
         except Exception as e:
             logging.error(f"Conversion Error: {e}")
 
     def get_structured_data_for_export():
-        flat_cells_all = []
-        for word_idx, item in enumerate(state["current_mapped_data"]):
-            # エクスポート時も空データを除外するかどうかですが、
-            # プレビューと一致させるため、空のセルリストを持つものはスキップします
-            if not item['cells']:
-                continue
-                
-            for cell in item['cells']:
-                flat_cells_all.append(cell) 
-            
-            # 次の「有効な」要素がある場合のみスペースを入れたいが、
-            # 簡易的に末尾以外にはスペースを入れる（ただし厳密にはプレビューと同じロジックが望ましい）
-            # ここでは既存ロジックを維持しつつ、もし問題があれば valid_indices 方式に合わせる
-            if word_idx < len(state["current_mapped_data"]) - 1:
-                flat_cells_all.append({'dots': SPACE_MARK, 'char': ' '})
-                
-        lines = split_cells_with_rules(flat_cells_all, settings["max_chars_per_line"])
-        lines_per_plate = settings["max_lines_per_plate"]
-        plates = [lines[i:i + lines_per_plate] for i in range(0, len(lines), lines_per_plate)]
-        return plates
+        # プレビューと同じレイアウト結果を使う (変更がなければ再計算しない)
+        # プレートを1枚ずつ取り出すイテレータとして返し、STL出力へそのまま流す
+        return iter(get_layout_pages())
 
     def handle_save_button_click(e):
         # print("DEBUG: handle_save_button_click called")
@@ -524,7 +817,8 @@ def main(page: ft.Page):
         # 保存前に履歴に追加 (現在の状態をスナップショット保存)
         try:
             current_text = txt_input_ref.current.value if txt_input_ref.current else ""
-            history_manager.add_entry(current_text, settings, state["current_mapped_data"])
+            edits = [[idx, orig, reading] for idx, (orig, reading) in sorted(state["reading_edits"].items())]
+            history_manager.add_entry(current_text, settings, edits)
         except Exception as he:
             logging.error(f"History Save Error: {he}")
         try:
@@ -651,6 +945,20 @@ def main(page: ft.Page):
             history_manager.save_settings(settings)
             page.update()
 
+        def update_layout_info():
+            if not layout_info_ref.current: return
+            if settings["layout_mode"] == LAYOUT_OPTIMAL and state["current_mapped_data"]:
+                get_layout_pages()
+                layout_info_ref.current.value = f"通常の改行より {layout_engine.plates_saved} 枚少なくなります"
+            else:
+                layout_info_ref.current.value = ""
+
+        def on_layout_change(e):
+            settings["layout_mode"] = LAYOUT_OPTIMAL if e.control.value else LAYOUT_GREEDY
+            history_manager.save_settings(settings)
+            update_layout_info()
+            page.update()
+
         def on_thick_change(e):
             val = float(e.control.value)
             if thickness_label_ref.current: thickness_label_ref.current.value = f"{val:.1f}mm"
@@ -677,11 +985,14 @@ def main(page: ft.Page):
                     ft.Slider(ref=thickness_slider_ref, min=0.4, max=2.0, divisions=16, on_change=on_thick_change, expand=True),
                     ft.Text(ref=thickness_label_ref, width=60, text_align=ft.TextAlign.RIGHT)
                 ]),
-            ], height=300, tight=True),
+                ft.Switch(ref=layout_switch_ref, label="プレート数を最小化 (最適改行)", on_change=on_layout_change),
+                ft.Text(ref=layout_info_ref, style=TextStyles.CAPTION),
+            ], height=360, tight=True),
             actions=[ft.TextButton("閉じる", on_click=lambda e: [close_dialog(dlg), render_braille_preview()])],
         )
         open_dialog(dlg)
         # ダイアログが開いた直後に値を同期
+        update_layout_info()
         sync_settings_ui()
 
     # デザイン変更: 入力フィールドをコンテナで包み、背景色とボーダーを設定
@@ -694,12 +1005,14 @@ def main(page: ft.Page):
         bgcolor=AppColors.SURFACE, # テキストエリアは白
         border_radius=ft.BorderRadius(10, 10, 10, 10), # 角丸
         text_style=TextStyles.BODY,
-        on_change=lambda e: update_braille_from_input(e.control.value),
+        on_change=on_input_change,
         content_padding=20, # パディングで見やすく
         width=None, # 親のSTRETCHに従わせるためNoneまたは指定なし
     )
 
     header_actions = [
+        ft.IconButton(ref=undo_button_ref, icon=ft.Icons.UNDO, icon_color=AppColors.PRIMARY, tooltip="読みの修正を取り消す", disabled=True, on_click=undo_reading_edit),
+        ft.IconButton(ref=redo_button_ref, icon=ft.Icons.REDO, icon_color=AppColors.PRIMARY, tooltip="読みの修正をやり直す", disabled=True, on_click=redo_reading_edit),
         ft.IconButton(icon=ft.Icons.HISTORY, icon_color=AppColors.PRIMARY, tooltip="履歴", on_click=lambda e: show_history_dialog(e)),
         ft.IconButton(icon=ft.Icons.SETTINGS, icon_color=AppColors.PRIMARY, tooltip="設定", on_click=lambda e: show_settings(e)),
         # ft.IconButton(icon=ft.Icons.SAVE_ALT, icon_color=AppColors.PRIMARY, tooltip="保存", on_click=handle_save_button_click)
@@ -723,10 +1036,52 @@ def main(page: ft.Page):
         bgcolor=AppColors.BACKGROUND
     )
 
+    # 辞書の読み込み中の表示
+    loading_indicator = ft.Row([
+        ft.ProgressRing(width=12, height=12, stroke_width=2),
+        ft.Text("辞書を読み込み中… (漢字の読みは読み込み後に反映されます)", style=TextStyles.CAPTION),
+    ], spacing=6, visible=not converter.is_ready)
+
+    def on_dictionary_ready():
+        tracer.record("startup:dictionary", converter.load_seconds)
+        if converter.error_msg:
+            logging.warning(f"Dictionary Load Warning: {converter.error_msg}")
+        else:
+            logging.info(f"Dictionary loaded in {converter.load_seconds:.2f}s")
+        # 読み込み用のスレッドから呼ばれるので、画面の更新はページのイベント処理側で行う
+        page.run_thread(finish_dictionary_load)
+
+    def finish_dictionary_load():
+        try:
+            loading_indicator.visible = False
+            loading_indicator.update()
+            # 読み込み中に選ばれた履歴があれば、ここで読みの修正ごと復元する
+            if state["pending_restore"] is not None:
+                restore_history_item(state["pending_restore"])
+            # 読み込み前に入力された文章を辞書を使って変換し直す
+            elif state["fallback_converted"] and converter.use_kakasi and txt_input_ref.current:
+                reconvert_with_dictionary(txt_input_ref.current.value)
+        except Exception as e:
+            logging.error(f"Reconvert Error: {e}")
+
+    def reconvert_with_dictionary(text):
+        """簡易変換の結果を辞書で変換し直し、読みの手動修正は表記が一致する箇所に当て直す"""
+        edits = [[idx, orig, reading] for idx, (orig, reading) in sorted(state["reading_edits"].items())]
+        with tracer.span("keystroke"):
+            convert_and_render(text)
+            if edits:
+                mapped_data = state["current_mapped_data"]
+                state["reading_edits"] = apply_edits(converter, mapped_data, edits)
+                set_mapped_data(mapped_data)
+                render_braille_preview()
+
     body_content = ft.Column([
         ft.Container(
             content=ft.Column([
-                ft.Text("点字プレビュー", style=TextStyles.CAPTION),
+                ft.Row([
+                    ft.Text("点字プレビュー", style=TextStyles.CAPTION),
+                    loading_indicator,
+                ], spacing=10, wrap=True),
                 ft.Container(
                     content=braille_display_area,
                     expand=True,
@@ -770,6 +1125,10 @@ def main(page: ft.Page):
 
     # 最後に確実に更新
     page.update()
+    tracer.record("startup:first_frame", time.perf_counter() - main_started)
+
+    # 最初の画面を出してから辞書を読み込む
+    converter.load_async(on_dictionary_ready)
 
 if __name__ == "__main__":
     assets_path = os.path.join(os.getcwd(), "assets")
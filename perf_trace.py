@@ -0,0 +1,203 @@
+"""
+処理時間の計測 (入力1回ごとのどこに時間がかかっているかを調べる)
+
+with tracer.span("tokenize"): のように処理段ごとに囲むと、所要時間を
+段ごとのリングバッファ (古いものから捨てる) に記録する。
+無効時の span() は何もしない共有オブジェクトを返すだけなので、計測箇所を残したままでよい。
+1回の変換の中で何度も通る処理段は stage_timer() で合計し、変換ごとに1件として記録する。
+
+起動時間の回帰を追うため、import_timed() でモジュールごとの import 時間も記録する。
+`python perf_trace.py` で UI を除くモジュールの import と辞書の読み込み時間を表示する。
+"""
+import importlib
+import json
+import math
+import sys
+import threading
+import time
+from collections import deque
+
+# 記録する処理段 (表示順)
+STAGES = ("keystroke", "tokenize", "cells", "layout", "controls", "page_update")
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "stage", "started")
+
+    def __init__(self, tracer, stage):
+        self.tracer = tracer
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class _NullStageTimer:
+    __slots__ = ()
+
+    def span(self, stage):
+        return _NULL_SPAN
+
+    def flush(self):
+        pass
+
+
+_NULL_STAGE_TIMER = _NullStageTimer()
+
+
+class _StageSpan:
+    __slots__ = ("timer", "stage", "started")
+
+    def __init__(self, timer, stage):
+        self.timer = timer
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        totals = self.timer.totals
+        totals[self.stage] = totals.get(self.stage, 0.0) + time.perf_counter() - self.started
+        return False
+
+
+class StageTimer:
+    """
+    処理段ごとの所要時間を合計しておき、flush() でまとめて1件ずつ記録する
+    (スパンや単語ごとに記録するとサンプル数が入力の長さに比例してしまうため)
+    """
+    __slots__ = ("tracer", "totals")
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.totals = {}
+
+    def span(self, stage):
+        return _StageSpan(self, stage)
+
+    def flush(self):
+        totals, self.totals = self.totals, {}
+        for stage, seconds in totals.items():
+            self.tracer.record(stage, seconds)
+
+
+class Tracer:
+    def __init__(self, capacity=1000, enabled=False):
+        self.capacity = capacity
+        self.enabled = enabled
+        self._samples = {}  # 処理段 -> 所要時間(秒) のリングバッファ
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        """処理段 stage の所要時間を計る with 用オブジェクト"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, stage)
+
+    def stage_timer(self):
+        """1回の処理の中で処理段ごとの時間を合計する StageTimer (無効時は何もしない共有オブジェクト)"""
+        if not self.enabled:
+            return _NULL_STAGE_TIMER
+        return StageTimer(self)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.capacity)
+            samples.append(seconds)
+
+    def clear(self):
+        with self._lock:
+            self._samples = {}
+
+    def stats(self):
+        """処理段ごとの件数と p50 / p95 / 最大 (ミリ秒)"""
+        with self._lock:
+            snapshot = {stage: sorted(samples) for stage, samples in self._samples.items()}
+        order = [s for s in STAGES if s in snapshot] + sorted(s for s in snapshot if s not in STAGES)
+        result = {}
+        for stage in order:
+            values = snapshot[stage]
+            if not values:
+                continue
+            result[stage] = {
+                "count": len(values),
+                "p50_ms": _percentile(values, 50) * 1000,
+                "p95_ms": _percentile(values, 95) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return result
+
+    def report(self):
+        """stats() を表形式のテキストにする"""
+        stats = self.stats()
+        width = max([12] + [len(stage) + 1 for stage in stats])
+        lines = [f"{'stage':<{width}}{'n':>6}{'p50':>9}{'p95':>9}{'max':>9}"]
+        for stage, s in stats.items():
+            lines.append(
+                f"{stage:<{width}}{s['count']:>6}{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}"
+            )
+        return "\n".join(lines)
+
+    def to_json(self):
+        """不具合報告に添付する用の JSON (集計値と生の計測値)"""
+        with self._lock:
+            samples = {stage: [round(v * 1000, 3) for v in values] for stage, values in self._samples.items()}
+        return json.dumps({
+            "capacity": self.capacity,
+            "stats": self.stats(),
+            "samples_ms": samples,
+        }, ensure_ascii=False, indent=2)
+
+
+def _percentile(sorted_values, pct):
+    # 最近傍法 (件数が少なくても実際の計測値を返す)
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+# アプリ全体で共有するトレーサー (デバッグ画面から有効にする)
+tracer = Tracer()
+
+
+def import_timed(name):
+    """モジュールを import し、かかった時間を "import:<name>" として記録する (計測の有効・無効によらない)"""
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    tracer.record(f"import:{name}", time.perf_counter() - started)
+    return module
+
+
+# python perf_trace.py で計測するモジュール (UI を使わないもの)
+PROFILE_MODULES = ("braille_logic", "braille_layout", "braille_pipeline", "word_index", "stl_generator")
+
+if __name__ == "__main__":
+    # 各モジュールが import する perf_trace をこのモジュール自身にする (トレーサーを共有する)
+    sys.modules.setdefault("perf_trace", sys.modules[__name__])
+    for name in sys.argv[1:] or PROFILE_MODULES:
+        import_timed(name)
+    converter = sys.modules["braille_logic"].BrailleConverter()
+    tracer.record("startup:dictionary", converter.load_seconds)
+    print(tracer.report())
@@ -0,0 +1,166 @@
+"""
+プレートのプレビュー描画 (Canvas 版)
+
+1行を1つの Canvas に図形として描く。セルごとにコントロールを作らないので、
+プレート1枚あたりのコントロール数はセル数によらず行数分だけになる。
+タップ位置は hit_test でセル (word_idx) に戻す。
+PlateView は行ごとのコントロールを保持し、レイアウトが変わったときは
+内容の変わった行だけを差し替える。
+"""
+from difflib import SequenceMatcher
+
+import flet as ft
+import flet.canvas as cv
+
+from styles import AppColors, TextStyles
+
+# セルの寸法 (旧来の Container 版と同じ見た目になるようにしている)
+DOT_SIZE = 8
+DOT_GAP = 2
+CELL_PADDING = 4
+CELL_WIDTH = CELL_PADDING * 2 + DOT_SIZE * 2 + DOT_GAP
+BOX_HEIGHT = CELL_PADDING * 2 + DOT_SIZE * 3 + DOT_GAP * 2
+READING_GAP = 2
+READING_HEIGHT = 14
+LINE_HEIGHT = BOX_HEIGHT + READING_GAP + READING_HEIGHT
+CELL_GAP = 8
+LINE_GAP = 10
+
+# プレート1枚分の枠 (ラベル + 余白と枠線 + 行の Canvas + 横スクロールバー + プレート間)
+LABEL_HEIGHT = TextStyles.PLATE_LABEL.size + 8
+LABEL_SPACING = 2
+FRAME_PADDING = 10
+FRAME_BORDER = 1
+SCROLLBAR_HEIGHT = 10
+PLATE_GAP = 10
+
+_PAINT_ACTIVE = ft.Paint(color=AppColors.DOT_ACTIVE, style=ft.PaintingStyle.FILL)
+_PAINT_INACTIVE = ft.Paint(color=AppColors.DOT_INACTIVE, style=ft.PaintingStyle.FILL)
+_PAINT_BOX = ft.Paint(color=AppColors.SURFACE, style=ft.PaintingStyle.FILL)
+
+# 6点のパターン -> セル左上からの点の中心座標と凸/凹 (パターンごとに1回だけ計算する)
+_glyph_cache = {}
+
+
+def _glyph(dots):
+    key = tuple(bool(d) for d in dots[:6])
+    glyph = _glyph_cache.get(key)
+    if glyph is None:
+        glyph = []
+        for i, active in enumerate(key):
+            col, row = divmod(i, 3)
+            cx = CELL_PADDING + col * (DOT_SIZE + DOT_GAP) + DOT_SIZE / 2
+            cy = CELL_PADDING + row * (DOT_SIZE + DOT_GAP) + DOT_SIZE / 2
+            glyph.append((cx, cy, active))
+        _glyph_cache[key] = glyph
+    return glyph
+
+
+def canvas_width(chars):
+    return max(0, chars * (CELL_WIDTH + CELL_GAP) - CELL_GAP)
+
+
+def canvas_height(lines):
+    return max(0, lines * (LINE_HEIGHT + LINE_GAP) - LINE_GAP)
+
+
+def plate_height(lines):
+    """プレビュー上のプレート1枚分の高さ (枠とプレート間の余白を含む)"""
+    frame = (FRAME_PADDING + FRAME_BORDER) * 2
+    return LABEL_HEIGHT + LABEL_SPACING + frame + canvas_height(lines) + SCROLLBAR_HEIGHT + PLATE_GAP
+
+
+def line_shapes(line_cells):
+    """1行を描く図形のリスト"""
+    shapes = []
+    for col, cell in enumerate(line_cells):
+        x = col * (CELL_WIDTH + CELL_GAP)
+        shapes.append(cv.Rect(x, 0, CELL_WIDTH, BOX_HEIGHT, border_radius=4, paint=_PAINT_BOX))
+        for cx, cy, active in _glyph(cell['dots']):
+            shapes.append(cv.Circle(
+                x + cx, cy, DOT_SIZE / 2,
+                paint=_PAINT_ACTIVE if active else _PAINT_INACTIVE,
+            ))
+        if cell['char']:
+            shapes.append(cv.Text(
+                x, BOX_HEIGHT + READING_GAP, cell['char'],
+                style=TextStyles.READING, text_align=ft.TextAlign.CENTER, max_width=CELL_WIDTH,
+            ))
+    return shapes
+
+
+def hit_test(line_cells, x, y):
+    """行の Canvas 上の座標にあるセルを返す (セルの間や外側なら None)"""
+    if x < 0 or y < 0 or y >= LINE_HEIGHT:
+        return None
+    col, dx = divmod(x, CELL_WIDTH + CELL_GAP)
+    col = int(col)
+    if dx >= CELL_WIDTH or col >= len(line_cells):
+        return None
+    return line_cells[col]
+
+
+def _tap_position(e):
+    # Flet のバージョンによって座標の持ち方が異なる
+    pos = getattr(e, 'local_position', None)
+    if pos is not None:
+        return pos.x, pos.y
+    return e.local_x, e.local_y
+
+
+def build_line_canvas(line_cells, on_word_tap):
+    """
+    1行分の Canvas を作る。
+    タップされたセルが単語に属していれば on_word_tap(word_idx) を呼ぶ。
+    """
+    def handle_tap(e):
+        cell = hit_test(line_cells, *_tap_position(e))
+        if cell is not None and cell['word_idx'] != -1:
+            on_word_tap(cell['word_idx'])
+
+    canvas = cv.Canvas(
+        shapes=line_shapes(line_cells),
+        width=canvas_width(len(line_cells)),
+        height=LINE_HEIGHT,
+    )
+    return ft.GestureDetector(content=canvas, on_tap_down=handle_tap)
+
+
+def line_key(line_cells):
+    """行の内容を比較するためのキー (同じキーなら描画もタップ先も同じ)"""
+    return tuple((tuple(c['dots']), c['char'], c['word_idx']) for c in line_cells)
+
+
+class PlateView:
+    """
+    プレート1枚分のプレビュー (行ごとの Canvas を縦に並べる)
+    patch() で新しいレイアウトとの差分を取り、変わった行だけ作り直す。
+    """
+    def __init__(self, plate_lines, on_word_tap):
+        self.on_word_tap = on_word_tap
+        self.keys = [line_key(line) for line in plate_lines]
+        self.column = ft.Column(
+            [build_line_canvas(line, on_word_tap) for line in plate_lines],
+            spacing=LINE_GAP,
+        )
+        self.control = ft.Row([self.column], scroll=ft.ScrollMode.ALWAYS)
+
+    def patch(self, plate_lines):
+        """
+        plate_lines に合わせて行を差し替え・挿入・削除する。
+        update() を送る必要のあるコントロールのリストを返す (変化がなければ空)。
+        """
+        keys = [line_key(line) for line in plate_lines]
+        if keys == self.keys:
+            return []
+        old_controls = self.column.controls
+        controls = []
+        for tag, i1, i2, j1, j2 in SequenceMatcher(None, self.keys, keys, autojunk=False).get_opcodes():
+            if tag == 'equal':
+                controls.extend(old_controls[i1:i2])
+            else:
+                controls.extend(build_line_canvas(line, self.on_word_tap) for line in plate_lines[j1:j2])
+        self.keys = keys
+        self.column.controls = controls
+        # 行の並びごと送り直す (変わっていない行のコントロールはそのまま使い回される)
+        return [self.column]
@@ -1,8 +1,25 @@
+import os
 import struct
+import tempfile
 import zipfile
 import math
 from braille_logic import BRAILLE_MAP, NUM_INDICATOR, SPACE_MARK
 
+# Braille ASCII (BSE) 変換表: 6点のビット値 -> 文字
+BSE_ASCII_MAP = {
+    0x00: ' ', 0x01: 'a', 0x03: 'b', 0x09: 'c', 0x19: 'd', 0x11: 'e',
+    0x0B: 'f', 0x1B: 'g', 0x13: 'h', 0x0A: 'i', 0x1A: 'j', 0x05: 'k',
+    0x07: 'l', 0x0D: 'm', 0x1D: 'n', 0x15: 'o', 0x0F: 'p', 0x1F: 'q',
+    0x17: 'r', 0x0E: 's', 0x1E: 't', 0x25: 'u', 0x27: 'v', 0x3A: 'w',
+    0x2D: 'x', 0x3D: 'y', 0x35: 'z',
+    0x3C: '#', 0x30: ';', 0x10: '"', 0x20: ',', 0x08: '@', 0x18: '^', 0x28: '_',
+    0x02: '1', 0x06: '2', 0x12: '3', 0x32: '4', 0x22: '5', 0x16: '6',
+    0x36: '7', 0x26: '8', 0x14: '9', 0x34: '0',
+    0x04: "'", 0x0C: '/', 0x1C: '>', 0x24: '-', 0x2C: '%', 0x3E: '=',
+    0x21: '*', 0x23: '<', 0x29: '[', 0x2B: '$', 0x2F: '+', 0x31: ']',
+    0x33: ':', 0x37: '?', 0x38: '!', 0x39: '(', 0x3B: ')', 0x3F: '|'
+}
+
 class STLGenerator:
     def generate_package(self, flat_cells, output_zip_path, max_chars_per_line=10, max_lines_per_plate=1, original_text_str="", base_thickness=1.0):
         """旧メソッド互換用"""
@@ -13,75 +30,78 @@ class STLGenerator:
     def generate_package_from_plates(self, plates_data, output_zip_path, original_text_str="", base_thickness=1.0):
         """
         プレートデータを受け取ってZIP生成
+        plates_data はリストでもジェネレータでもよい（1回だけ走査し、STLは一時ファイルへ書き出す）
+        ZIPのメンバー順は original_text.txt, braille.bse, guide_sheet.html, plate_XX.stl のまま
         """
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            zipf.writestr("original_text.txt", original_text_str.encode('utf-8'))
-            
-            # BSE出力
-            bse_content = self._generate_bse_content(plates_data)
-            zipf.writestr("braille.bse", bse_content.encode('utf-8'))
-
-            pages_info = []
+        with tempfile.TemporaryDirectory(prefix="braille_stl_") as spool_dir:
+            bse_lines = []
+            guide_rows = []
+            stl_files = []
             for i, plate_lines in enumerate(plates_data):
                 page_num = i + 1
                 page_num_dots = self._int_to_braille_dots(page_num)
-                
+
                 plate_body_dots = []
                 for line in plate_lines:
                     line_dots = [c['dots'] for c in line]
                     plate_body_dots.append(line_dots)
-                
-                pages_info.append({
+
+                info = {
                     'page_num': page_num,
-                    'plate_lines': plate_lines, 
+                    'plate_lines': plate_lines,
                     'page_dots': page_num_dots,
                     'body_lines_dots': plate_body_dots
-                })
+                }
+                bse_lines.extend(self._plate_to_bse_lines(plate_lines))
+                guide_rows.append(self._guide_rows_html(info))
 
-            html_content = self._generate_guide_html(pages_info)
-            zipf.writestr("guide_sheet.html", html_content.encode('utf-8'))
+                # STLはプレートを手放す前に一時ファイルへ（メモリに溜めない）
+                stl_filename = f"plate_{page_num:02d}.stl"
+                stl_path = os.path.join(spool_dir, stl_filename)
+                with open(stl_path, 'wb') as f:
+                    f.write(self._create_plate_stl(plate_body_dots, page_num_dots, base_thickness))
+                stl_files.append((stl_path, stl_filename))
+
+            with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                zipf.writestr("original_text.txt", original_text_str.encode('utf-8'))
+
+                # BSE出力
+                zipf.writestr("braille.bse", "\r\n".join(bse_lines).encode('utf-8'))
+
+                html_content = self._guide_html_document("".join(guide_rows))
+                zipf.writestr("guide_sheet.html", html_content.encode('utf-8'))
+
+                for stl_path, stl_filename in stl_files:
+                    zipf.write(stl_path, stl_filename)
 
-            for info in pages_info:
-                stl_filename = f"plate_{info['page_num']:02d}.stl"
-                stl_data = self._create_plate_stl(info['body_lines_dots'], info['page_dots'], base_thickness)
-                zipf.writestr(stl_filename, stl_data)
-        
         return output_zip_path
 
     def _generate_bse_content(self, plates_data):
         """BSE形式(Braille ASCII)に変換"""
-        ascii_map = {
-            0x00: ' ', 0x01: 'a', 0x03: 'b', 0x09: 'c', 0x19: 'd', 0x11: 'e',
-            0x0B: 'f', 0x1B: 'g', 0x13: 'h', 0x0A: 'i', 0x1A: 'j', 0x05: 'k',
-            0x07: 'l', 0x0D: 'm', 0x1D: 'n', 0x15: 'o', 0x0F: 'p', 0x1F: 'q',
-            0x17: 'r', 0x0E: 's', 0x1E: 't', 0x25: 'u', 0x27: 'v', 0x3A: 'w',
-            0x2D: 'x', 0x3D: 'y', 0x35: 'z',
-            0x3C: '#', 0x30: ';', 0x10: '"', 0x20: ',', 0x08: '@', 0x18: '^', 0x28: '_',
-            0x02: '1', 0x06: '2', 0x12: '3', 0x32: '4', 0x22: '5', 0x16: '6',
-            0x36: '7', 0x26: '8', 0x14: '9', 0x34: '0', 
-            0x04: "'", 0x0C: '/', 0x1C: '>', 0x24: '-', 0x2C: '%', 0x3E: '=',
-            0x21: '*', 0x23: '<', 0x29: '[', 0x2B: '$', 0x2F: '+', 0x31: ']',
-            0x33: ':', 0x37: '?', 0x38: '!', 0x39: '(', 0x3B: ')', 0x3F: '|'
-        }
-
         bse_lines = []
         for plate in plates_data:
-            for line_cells in plate:
-                line_str = ""
-                for cell in line_cells:
-                    dots = cell['dots']
-                    val = 0
-                    if dots[0]: val += 1
-                    if dots[1]: val += 2
-                    if dots[2]: val += 4
-                    if dots[3]: val += 8
-                    if dots[4]: val += 16
-                    if dots[5]: val += 32
-                    line_str += ascii_map.get(val, '?')
-                bse_lines.append(line_str)
-            bse_lines.append("") 
+            bse_lines.extend(self._plate_to_bse_lines(plate))
         return "\r\n".join(bse_lines)
 
+    def _plate_to_bse_lines(self, plate):
+        """1プレート分をBSEの行リストに変換 (末尾にプレート区切りの空行を含む)"""
+        bse_lines = []
+        for line_cells in plate:
+            line_str = ""
+            for cell in line_cells:
+                dots = cell['dots']
+                val = 0
+                if dots[0]: val += 1
+                if dots[1]: val += 2
+                if dots[2]: val += 4
+                if dots[3]: val += 8
+                if dots[4]: val += 16
+                if dots[5]: val += 32
+                line_str += BSE_ASCII_MAP.get(val, '?')
+            bse_lines.append(line_str)
+        bse_lines.append("")
+        return bse_lines
+
     def _int_to_braille_dots(self, n):
         s = str(n)
         dots = [NUM_INDICATOR]
@@ -339,27 +359,32 @@ class STLGenerator:
                 prev_ring_points = current_ring_points
 
     def _generate_guide_html(self, pages_info):
-        rows = ""
-        for info in pages_info:
-            page_num = info['page_num']
-            plate_lines = info['plate_lines']
-            page_dots = info['page_dots']
-            page_braille_str = "".join([self._dots_to_unicode(d) for d in page_dots])
-
-            rows += f"<div class='plate-block'><h2>Plate {page_num:02d} <span class='page-braille'>({page_braille_str})</span></h2>"
-            rows += "<table border='1' cellspacing='0' cellpadding='5' style='border-collapse: collapse; width: 100%;'>"
-            rows += "<tr style='background-color: #f0f0f0;'><th>Line</th><th>Content</th></tr>"
-            
-            for line_idx, line_cells in enumerate(plate_lines):
-                line_content_html = ""
-                for cell in line_cells:
-                    char = cell['char']
-                    uni_char = self._dots_to_unicode(cell['dots'])
-                    line_content_html += f"<div style='display:inline-block; text-align:center; margin:2px; border:1px solid #eee; padding:2px;'><div style='font-size:20px;'>{uni_char}</div><div style='font-size:12px;'>{char}</div></div>"
-                
-                rows += f"<tr><td align='center' width='50'>L{line_idx+1}</td><td>{line_content_html}</td></tr>"
-            rows += "</table></div><br>"
+        rows = "".join(self._guide_rows_html(info) for info in pages_info)
+        return self._guide_html_document(rows)
+
+    def _guide_rows_html(self, info):
+        """1プレート分のガイドシートHTML断片"""
+        page_num = info['page_num']
+        plate_lines = info['plate_lines']
+        page_dots = info['page_dots']
+        page_braille_str = "".join([self._dots_to_unicode(d) for d in page_dots])
+
+        rows = f"<div class='plate-block'><h2>Plate {page_num:02d} <span class='page-braille'>({page_braille_str})</span></h2>"
+        rows += "<table border='1' cellspacing='0' cellpadding='5' style='border-collapse: collapse; width: 100%;'>"
+        rows += "<tr style='background-color: #f0f0f0;'><th>Line</th><th>Content</th></tr>"
+
+        for line_idx, line_cells in enumerate(plate_lines):
+            line_content_html = ""
+            for cell in line_cells:
+                char = cell['char']
+                uni_char = self._dots_to_unicode(cell['dots'])
+                line_content_html += f"<div style='display:inline-block; text-align:center; margin:2px; border:1px solid #eee; padding:2px;'><div style='font-size:20px;'>{uni_char}</div><div style='font-size:12px;'>{char}</div></div>"
+
+            rows += f"<tr><td align='center' width='50'>L{line_idx+1}</td><td>{line_content_html}</td></tr>"
+        rows += "</table></div><br>"
+        return rows
 
+    def _guide_html_document(self, rows):
         return f"""
         <html><head><meta charset="UTF-8">
         <style>
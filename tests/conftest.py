@@ -0,0 +1,5 @@
+import os
+import sys
+
+# テストからアプリのモジュール (リポジトリ直下) を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+"""かなだけの区間が Janome を経由せずに規則で分かち書きされることの確認"""
+import pytest
+
+from braille_logic import BrailleConverter
+
+# かなだけの文と、期待する分かち書き
+KANA_REGRESSION_TEXTS = {
+    "これはペンです": ['これは', 'ペン', 'です'],
+    "わたしはがくせいです": ['わたしはがくせい', 'です'],
+    "きょうはいいてんきですね": ['きょうはいいてんき', 'です', 'ね'],
+    "あしたまたあいましょう": ['あしたまたあい', 'ましょう'],
+    "コーヒーをのみます": ['コーヒー', 'を', 'のみ', 'ます'],
+    "パンとミルクをかいました": ['パン', 'と', 'ミルク', 'を', 'かい', 'ました'],
+    "ごはんをたべる": ['ごはん', 'を', 'たべる'],
+}
+
+
+class ExplodingTokenizer:
+    """かなだけの区間で形態素解析が呼ばれたら失敗させる"""
+    def tokenize(self, text):
+        raise AssertionError(f"tokenizer called for {text!r}")
+
+
+def kana_converter():
+    converter = BrailleConverter(defer_load=True)
+    converter.tokenizer = ExplodingTokenizer()
+    converter.use_kakasi = True
+    return converter
+
+
+@pytest.mark.parametrize("text, words", KANA_REGRESSION_TEXTS.items())
+def test_kana_sentence_is_split_without_tokenizer(text, words):
+    entries = kana_converter().convert_with_mapping(text)
+    assert [e['orig'] for e in entries] == words
+    # 位置は元テキスト基準で途切れずに続く
+    assert ''.join(text[e['start']:e['end']] for e in entries) == text
+
+
+def test_kana_readings_and_overrides():
+    converter = kana_converter()
+    converter.reading_overrides = {'は': 'わ'}
+    entries = converter.convert_with_mapping("ペンはごはん")
+    # 上書きは表記が一致する語だけに効く (語の中の「は」は変わらない)
+    assert [(e['orig'], e['reading']) for e in entries] == [
+        ('ペン', 'ぺん'), ('は', 'わ'), ('ごはん', 'ごはん'),
+    ]
+
+
+def test_kana_spans_keep_offsets_around_other_scripts():
+    entries = kana_converter().convert_with_mapping("  ペン3ぼん です")
+    assert [(e['orig'], e['start']) for e in entries] == [
+        ('ペン', 2), ('3', 4), ('ぼん', 5), (' ', 7), ('です', 8),
+    ]
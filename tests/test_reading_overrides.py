@@ -0,0 +1,56 @@
+"""読みの上書き (ユーザー辞書) が語の区切りを変えないことの確認"""
+from types import SimpleNamespace
+
+import pytest
+
+from braille_logic import BrailleConverter, OVERRIDE_COST
+
+
+class FakeSysDic:
+    """lookup / lookup_extra だけを持つシステム辞書の代わり"""
+    ENTRIES = [
+        # (表記, 左文脈ID, 右文脈ID, コスト, 品詞, 活用型, 活用形, 基本形)
+        ('は', 261, 261, 3865, '助詞,係助詞,*,*', '*', '*', 'は'),
+        ('は', 1285, 1285, 7439, '名詞,一般,*,*', '*', '*', 'は'),
+        ('ごはん', 1285, 1285, 4000, '名詞,一般,*,*', '*', '*', 'ごはん'),
+    ]
+
+    def lookup(self, s, matcher):
+        text = s.decode('utf-8')
+        return [(num,) + e[:4] for num, e in enumerate(self.ENTRIES) if text.startswith(e[0])]
+
+    def lookup_extra(self, num):
+        return self.ENTRIES[num][4:] + ('*', '*')
+
+
+def fake_converter():
+    converter = BrailleConverter(defer_load=True)
+    converter.tokenizer = SimpleNamespace(sys_dic=FakeSysDic(), matcher=None)
+    return converter
+
+
+def test_override_copies_system_entries():
+    rows = fake_converter()._override_rows({'は': 'わ'})
+    # 辞書の見出しごとに連接IDとコストをそのまま写し、読みだけを差し替える
+    assert rows == [
+        'は,261,261,3865,助詞,係助詞,*,*,*,*,は,わ,わ',
+        'は,1285,1285,7439,名詞,一般,*,*,*,*,は,わ,わ',
+    ]
+
+
+def test_override_outside_dictionary():
+    rows = fake_converter()._override_rows({'点': 'てん', '点字器': 'てんじき'})
+    # 辞書にない1文字の表記は登録せず、2文字以上の表記は1語として登録する
+    assert rows == [f'点字器,0,0,{OVERRIDE_COST},カスタム名詞,*,*,*,*,*,点字器,てんじき,てんじき']
+
+
+def test_particle_override_keeps_segmentation():
+    converter = BrailleConverter()
+    if not converter.use_kakasi:
+        pytest.skip("Janome の辞書がない")
+    text = "私はごはんとはしを買った"
+    before = [e['orig'] for e in converter.convert_with_mapping(text)]
+    converter.update_reading_overrides({'は': 'わ'}, background=False)
+    after = converter.convert_with_mapping(text)
+    assert [e['orig'] for e in after] == before
+    assert [e['reading'] for e in after if e['orig'] == 'は'] == ['わ']
@@ -0,0 +1,140 @@
+"""
+プロセス全体で共有する形態素解析サービス (Flet の Web 版で複数セッションを捌く用)
+
+Web 版ではブラウザのセッションごとに main(page) が呼ばれる。セッションごとに Tokenizer を
+作ると Matcher の構築が毎回走るため、ここで1回だけ行う。
+- システム辞書 (SystemDictionary / MMapSystemDictionary) と FST のバイト列は全セッションで共有する
+- Tokenizer の窓口 (Matcher のキャッシュを持つ) を少数プールし、解析1回ごとに貸し出す
+- セッションごとに持つのは文書データと読みの上書き (ユーザー辞書) だけ
+
+BrailleConverter(service=get_service()) のように渡して使う。
+`python tokenizer_service.py [セッション数]` で複数セッションの同時変換を試せる。
+"""
+import copy
+import importlib.util
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+# Janome は辞書を読み込むとき (load) に初めて import する (import 時にシステム辞書の初期化まで走るため)
+JANOME_AVAILABLE = importlib.util.find_spec("janome") is not None
+
+
+class TokenizerService:
+    def __init__(self, pool_size=4):
+        self.pool_size = pool_size
+        self.sys_dic = None
+        self.error_msg = ""
+        self.load_seconds = 0.0
+        self._pool = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._loaded = threading.Event()
+
+    @property
+    def is_loaded(self):
+        return self._loaded.is_set()
+
+    def load(self):
+        """辞書を読み込む (最初の呼び出しだけが読み込み、同時に呼ばれた他のスレッドは完了を待つ)"""
+        if self._loaded.is_set():
+            if self.error_msg:
+                raise RuntimeError(self.error_msg)
+            return
+        with self._load_lock:
+            if not self._loaded.is_set():
+                started = time.perf_counter()
+                try:
+                    self._build_pool()
+                except Exception as e:
+                    self.error_msg = str(e) or repr(e)
+                finally:
+                    self.load_seconds = time.perf_counter() - started
+                    self._loaded.set()
+        if self.error_msg:
+            raise RuntimeError(self.error_msg)
+
+    def _build_pool(self):
+        if not JANOME_AVAILABLE:
+            raise RuntimeError("Module 'janome' not found")
+        # FST のデータ (プロセスで1回だけ読み込まれる) と展開済みの遷移表は窓口ごとの Matcher で共有する
+        # (Matcher の接頭辞キャッシュはスレッド間で共有できないため窓口ごとに分ける)
+        from janome.tokenizer import Tokenizer
+        base = Tokenizer()
+        base.user_dic = None
+        self.sys_dic = base.sys_dic
+        self._pool.put(base)
+        for _ in range(self.pool_size - 1):
+            front = copy.copy(base)
+            front.matcher = base.matcher.fork()
+            self._pool.put(front)
+
+    @contextmanager
+    def checkout(self, user_dic=None):
+        """
+        Tokenizer の窓口を1つ借りる (空きがなければ返却を待つ)。
+        user_dic を渡すと、貸し出し中だけそのユーザー辞書を使う。
+        """
+        self.load()
+        tokenizer = self._pool.get()
+        try:
+            tokenizer.user_dic = user_dic
+            yield tokenizer
+        finally:
+            tokenizer.user_dic = None
+            self._pool.put(tokenizer)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(pool_size=4):
+    """プロセスで1つの TokenizerService を返す (初回に作る。辞書の読み込みは load() で行う)"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TokenizerService(pool_size)
+        return _service
+
+
+if __name__ == "__main__":
+    # 複数セッションの同時変換を試す: 各セッションは自分の変換器 (読みの上書き付き) を持ち、
+    # 辞書と FST は共有する。結果が1スレッドで変換したものと一致するかを確かめる
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    from braille_logic import BrailleConverter
+
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    texts = [
+        "東京都庁は新宿区にあります",
+        "非常口は左手の階段を下りてください",
+        "お手洗いは2階です",
+        "受付 Reception 9:00-17:00",
+    ]
+    service = get_service()
+    started = time.perf_counter()
+    try:
+        service.load()
+    except RuntimeError as e:
+        print(f"Dictionary unavailable ({e}); sessions will use the fallback conversion.")
+    print(f"dictionary: {time.perf_counter() - started:.2f}s")
+
+    expected = [BrailleConverter(service=service).convert_with_mapping(t) for t in texts]
+
+    def run_session(n):
+        converter = BrailleConverter(service=service)
+        # セッションごとに別の読みの上書きを持たせる
+        converter.update_reading_overrides({f"セッション{n}": "せっしょん"}, background=False)
+        for _ in range(5):
+            for text, want in zip(texts, expected):
+                if converter.convert_with_mapping(text) != want:
+                    return False
+        return True
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(32, sessions)) as pool:
+        results = list(pool.map(run_session, range(sessions)))
+    elapsed = time.perf_counter() - started
+    print(f"{sessions} sessions: {elapsed:.2f}s, all consistent: {all(results)}")
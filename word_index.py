@@ -0,0 +1,45 @@
+class WordIndex:
+    """
+    mapped data の索引 (表記 -> 単語インデックスのリスト)
+    同じ語の全出現箇所を、リスト全体を走査せずに引けるようにする。
+    """
+    def __init__(self, mapped_data=None):
+        self.by_surface = {}
+        if mapped_data:
+            self.rebuild(mapped_data)
+
+    def rebuild(self, mapped_data):
+        self.by_surface = {}
+        for idx, item in enumerate(mapped_data):
+            self.add(idx, item)
+
+    def add(self, idx, item):
+        surface = item.get('orig', '')
+        self.by_surface.setdefault(surface, []).append(idx)
+
+    def find(self, surface):
+        """同じ表記の単語インデックス"""
+        return self.by_surface.get(surface, [])
+
+
+def apply_reading(mapped_data, indices, reading, cells):
+    """指定インデックスの単語に読みとセルをまとめて設定する (セルのリストは単語ごとに別物にする)"""
+    for idx in indices:
+        item = mapped_data[idx]
+        item['reading'] = reading
+        item['cells'] = list(cells)
+        item['braille'] = [c['dots'] for c in cells]
+
+
+def apply_edits(converter, mapped_data, edits):
+    """
+    履歴に保存した読みの修正 [[単語インデックス, 表記, 読み], ...] を mapped data に当てる。
+    表記が一致しない (変換結果が変わった) 箇所は飛ばす。
+    当てた修正を {単語インデックス: (表記, 読み)} で返す。
+    """
+    applied = {}
+    for idx, surface, reading in edits:
+        if 0 <= idx < len(mapped_data) and mapped_data[idx]['orig'] == surface:
+            apply_reading(mapped_data, [idx], reading, converter.kana_to_cells(reading))
+            applied[idx] = (surface, reading)
+    return applied